@@ -0,0 +1,155 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from main import video_info, process_video, add_pipeline_arguments, make_detector, make_tracker
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+PARAMETERS = ('roi', 'levels', 'detector', 'tracker')
+
+
+def list_videos(sources):
+    '''
+        Videos of every source: a directory (searched recursively), a manifest (.txt with a path per line
+        or a .json list, relative paths are relative to the manifest) or a video file.
+    '''
+    res = []
+    for source in sources:
+        if os.path.isdir(source):
+            for root, _, files in sorted(os.walk(source)):
+                res += [os.path.join(root, f) for f in sorted(files) if f.lower().endswith(VIDEO_EXTENSIONS)]
+        elif source.endswith(('.txt', '.json')):
+            with open(source) as f:
+                paths = json.load(f) if source.endswith('.json') else [line.strip() for line in f]
+            base = os.path.dirname(source)
+            res += [os.path.join(base, p) for p in paths if p and not p.startswith('#')]
+        else:
+            res.append(source)
+    return res
+
+
+def file_hash(path, block=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(block), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def output_path(path, input_root, output_dir):
+    '''
+        Output of a video in output_dir, keeping its path under input_root so that clips with the same name
+        in different directories don't collide.
+    '''
+    rel = os.path.relpath(os.path.abspath(path), input_root)
+    return os.path.join(output_dir, os.path.splitext(rel)[0] + '.mp4')
+
+
+def plan_outputs(videos, output_dir):
+    '''
+        (input, output) of every video, the outputs under the common directory of all the inputs, whether
+        they come from directories, manifests or files. A video listed twice is processed once. Two inputs
+        with the same output (e.g. clip.mp4 and clip.avi) would write the same files at the same time,
+        they raise a ValueError before any job starts.
+    '''
+    videos = list(dict.fromkeys(os.path.abspath(path) for path in videos))
+    if not videos:
+        return []
+    root = os.path.commonpath([os.path.dirname(path) for path in videos])
+    res, inputs = [], {}
+    for path in videos:
+        output = output_path(path, root, output_dir)
+        if output in inputs:
+            raise ValueError(f'{inputs[output]} and {path} would both be written to {output}')
+        inputs[output] = path
+        res.append((path, output))
+    return res
+
+
+def run_job(path, output, params, force=False):
+    '''
+        Processes one video in a pool worker. Everything the job needs (detector, tracker) is created here,
+        nothing is shared with other jobs. The output is skipped if the stamp next to it has the same
+        hash of the input and the same parameters. Errors are returned instead of raised,
+        so one broken clip doesn't stop the batch.
+    '''
+    res = {'input': path, 'output': output, 'status': 'done', 'frames': 0, 'seconds': 0.0}
+    # written under a temporary name first, an interrupted job never leaves an output that looks complete
+    tmp = output + '.part.mp4'
+    start = time.perf_counter()
+    try:
+        key = {'sha256': file_hash(path), 'params': params}
+        stamp = output + '.json'
+        if not force and os.path.exists(output) and os.path.exists(stamp):
+            with open(stamp) as f:
+                if json.load(f) == key:
+                    res['status'] = 'skipped'
+                    return res
+
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        _, res['frames'] = video_info(path)
+        args = argparse.Namespace(input=path, **params)
+        process_video(path, tmp, workers=1, detector=make_detector(args), tracker=make_tracker(args.tracker))
+        os.replace(tmp, output)
+        with open(stamp, 'w') as f:
+            json.dump(key, f)
+    except Exception as e:
+        res['status'] = 'failed'
+        res['error'] = f'{type(e).__name__}: {e}'
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    finally:
+        res['seconds'] = time.perf_counter() - start
+    return res
+
+
+def summarize(jobs, seconds, workers):
+    done = [job for job in jobs if job['status'] == 'done']
+    frames = sum(job['frames'] for job in done)
+    busy = sum(job['seconds'] for job in done)
+    return {
+        'videos': len(jobs),
+        'done': len(done),
+        'skipped': sum(job['status'] == 'skipped' for job in jobs),
+        'failed': sum(job['status'] == 'failed' for job in jobs),
+        'workers': workers,
+        'seconds': seconds,
+        'frames': frames,
+        'fps': frames / seconds if seconds > 0 else None,
+        'fps_per_worker': frames / busy if busy > 0 else None,
+        'videos_per_hour': len(done) * 3600 / seconds if seconds > 0 else None,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Detects and tracks cars in a batch of videos')
+    parser.add_argument('inputs', nargs='+', help='video files, directories or manifests (.txt or .json)')
+    parser.add_argument('--output-dir', default='output')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='videos processed at the same time')
+    parser.add_argument('--force', action='store_true', help='process the videos even if the outputs are up to date')
+    parser.add_argument('--report', default='batch.json', help='json file for the summary and the jobs')
+    add_pipeline_arguments(parser, profile=False)
+    args = parser.parse_args()
+
+    try:
+        videos = plan_outputs(list_videos(args.inputs), args.output_dir)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    params = {name: getattr(args, name) for name in PARAMETERS}
+
+    jobs = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(run_job, path, output, params, args.force) for path, output in videos]
+        for i, future in enumerate(as_completed(futures)):
+            job = future.result()
+            jobs.append(job)
+            print(f'[{i + 1}/{len(videos)}] {job["status"]:7} {job["input"]} {job["seconds"]:.1f} s'
+                  + (f' {job["error"]}' if 'error' in job else ''))
+
+    report = {'config': vars(args), 'summary': summarize(jobs, time.perf_counter() - start, args.jobs), 'jobs': jobs}
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report['summary'], indent=2))
@@ -0,0 +1,91 @@
+import argparse
+import functools
+import itertools
+import json
+import time
+from frames import iter_frames
+from main import VIDEO_PATH, LAG, find_boxes, is_candidate, bridge_roi, BackgroundDetector
+
+
+def iou(a, b):
+    x = max(a[0], b[0])
+    y = max(a[1], b[1])
+    w = min(a[0] + a[2], b[0] + b[2]) - x
+    h = min(a[1] + a[3], b[1] + b[3]) - y
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / (a[2] * a[3] + b[2] * b[3] - inter)
+
+
+def matches(ref, found, threshold=0.5):
+    '''
+        Number of found boxes greedily matched to a reference box with IoU of at least threshold.
+    '''
+    free = list(ref)
+    res = 0
+    for box in found:
+        scores = [iou(box, r) for r in free]
+        if scores and max(scores) >= threshold:
+            free.pop(scores.index(max(scores)))
+            res += 1
+    return res
+
+
+def run(frames, detector):
+    '''
+        Car candidates of every frame pair and the average seconds per frame.
+    '''
+    res = []
+    start = time.perf_counter()
+    for i in range(len(frames) - LAG):
+        res.append([box for box in detector(frames[i], frames[i + LAG]) if is_candidate(box)])
+    return res, (time.perf_counter() - start) / max(1, len(res))
+
+
+def compare(ref, boxes):
+    total_ref = sum(len(r) for r in ref)
+    total = sum(len(b) for b in boxes)
+    matched = sum(matches(r, b) for r, b in zip(ref, boxes))
+    return {
+        'candidates': total,
+        'precision': matched / total if total else 1.0,
+        'recall': matched / total_ref if total_ref else 1.0,
+    }
+
+
+def detectors(width):
+    res = {}
+    for roi, levels in itertools.product((None, 'bridge'), (0, 1, 2)):
+        name = f'roi={roi or "full"},levels={levels}'
+        res[name] = functools.partial(find_boxes, roi=bridge_roi(width) if roi else None, levels=levels)
+    for kind in ('mog2', 'knn', 'average'):
+        for roi in (None, 'bridge'):
+            res[f'{kind},roi={roi or "full"}'] = BackgroundDetector(kind, roi=bridge_roi(width) if roi else None)
+    return res
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Speed and quality of the detection settings (roi, downscaling, '
+                                                 'background models) compared with the full frame SSIM detection')
+    parser.add_argument('input', nargs='?', default=VIDEO_PATH)
+    parser.add_argument('--frames', type=int, default=300, help='number of frames to use')
+    parser.add_argument('--output', default=None, help='json file for the results')
+    args = parser.parse_args()
+
+    # the frames are pooled, keep a copy of the gray buffer
+    frames = [frame.gray.copy() for frame in itertools.islice(iter_frames(args.input), args.frames)]
+    width = frames[0].shape[1]
+    ref, ref_time = run(frames, find_boxes)
+    results = {}
+    for name, detector in detectors(width).items():
+        boxes, seconds = run(frames, detector)
+        results[name] = dict(compare(ref, boxes), ms_per_frame=seconds * 1000, fps=1 / seconds,
+                             speedup=ref_time / seconds)
+        r = results[name]
+        print(f'{name:24} {r["ms_per_frame"]:8.2f} ms/frame {r["fps"]:8.1f} fps  x{r["speedup"]:5.2f}  '
+              f'precision {r["precision"]:.3f}  recall {r["recall"]:.3f}  candidates {r["candidates"]}')
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
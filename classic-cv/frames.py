@@ -0,0 +1,80 @@
+import numpy as np
+import cv2
+
+
+class Frame:
+    '''
+        A decoded frame. image is BGR, as OpenCV reads and writes it. The gray version is converted
+        on first use of gray, into a buffer which is reused when the frame is.
+    '''
+    __slots__ = ('image', 'index', '_gray', '_gray_ready')
+
+    def __init__(self, image, gray=None, index=0):
+        self.image = image
+        self.index = index
+        self._gray = gray
+        self._gray_ready = gray is not None
+
+    @property
+    def gray(self):
+        if not self._gray_ready:
+            if self._gray is None:
+                self._gray = np.empty(self.image.shape[:2], np.uint8)
+            cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY, dst=self._gray)
+            self._gray_ready = True
+        return self._gray
+
+    def reset(self, index):
+        self.index = index
+        self._gray_ready = False
+
+
+def as_gray(frame):
+    return frame.gray if isinstance(frame, Frame) else frame
+
+
+class FramePool:
+    '''
+        size frames allocated once and reused round-robin: cap.read decodes straight into their buffers.
+        A frame is overwritten size reads later, so no more than size frames can be held at a time.
+    '''
+
+    def __init__(self, size, width, height):
+        self.frames = [Frame(np.empty((height, width, 3), np.uint8)) for _ in range(size)]
+        self.next = 0
+        self.count = 0
+
+    def read(self, cap):
+        frame = self.frames[self.next]
+        success, image = cap.read(frame.image)
+        if not success:
+            return None
+        # the decoder hands back its own array if the buffer does not fit the video
+        frame.image = image
+        frame.reset(self.count)
+        self.next = (self.next + 1) % len(self.frames)
+        self.count += 1
+        return frame
+
+
+def iter_frames(path_to_video, pool_size=2, start=0):
+    '''
+        Yields the frames of a video as pooled Frame objects, at most pool_size of them can be kept.
+    '''
+    cap = cv2.VideoCapture(path_to_video)
+
+    if not cap.isOpened():
+        raise IOError(f'Could not open {path_to_video}. Check if the path is correct.')
+
+    if start > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    pool = FramePool(pool_size, int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    pool.count = start
+    try:
+        while True:
+            frame = pool.read(cap)
+            if frame is None:
+                break
+            yield frame
+    finally:
+        cap.release()
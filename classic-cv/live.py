@@ -0,0 +1,185 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+import numpy as np
+import cv2
+from frames import Frame
+from profiling import PROFILER
+from main import VIDEO_PATH, LAG, open_writer, add_pipeline_arguments, make_detector, make_tracker
+
+
+def open_source(source):
+    '''
+        source is anything cv2.VideoCapture accepts: a file, a stream url or the number of a camera.
+    '''
+    cap = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+
+    if not cap.isOpened():
+        raise IOError(f'Could not open {source}. Check if the path is correct.')
+    return cap
+
+
+class LiveSource:
+    '''
+        Producer thread reading frames from a capture into a bounded queue of (frame, capture time) pairs.
+        When the consumer falls behind, the oldest queued frame is dropped to make room for the new one,
+        so a frame never waits behind more than size others. With replay a file is read at its own fps,
+        as a camera would deliver it. None is queued after the last frame.
+    '''
+
+    def __init__(self, source, size=4, replay=False):
+        self.cap = open_source(source)
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 25.0
+        self.replay = replay
+        self.frames = queue.Queue(maxsize=size)
+        self.read = 0
+        self.dropped = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def put(self, item):
+        while True:
+            try:
+                self.frames.put_nowait(item)
+                return
+            except queue.Full:
+                pass
+            try:
+                self.frames.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            while not self.stopped.is_set():
+                if self.replay:
+                    delay = start + self.read / self.fps - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                # frames are not pooled here: dropped ones would break the order the pool reuses them in
+                success, image = self.cap.read()
+                if not success:
+                    break
+                self.put((Frame(image, index=self.read), time.perf_counter()))
+                self.read += 1
+        finally:
+            self.cap.release()
+            self.put(None)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def run_live(source, detector, tracker, max_latency=None, on_frame=None):
+    '''
+        Consumer side: detects and tracks the cars in the frames of source as they come and calls
+        on_frame(image) with every processed frame. Frames already older than max_latency seconds
+        when they are taken from the queue are skipped. The cars are drawn on the newest frame, compared with
+        the one LAG frames before it, or with the background model of a stateful detector, which only looks
+        at its first argument and needs no window: the output lags only by the processing time.
+        Returns the end-to-end latency of every output frame, from capture to the return of on_frame.
+    '''
+    latency = []
+    late = 0
+    stateful = getattr(detector, 'stateful', False)
+    window = deque(maxlen=LAG + 1)
+    while True:
+        item = source.frames.get()
+        if item is None:
+            break
+        frame, captured = item
+        if max_latency is not None and time.perf_counter() - captured > max_latency:
+            late += 1
+            continue
+        if stateful:
+            boxes = detector(frame, frame)
+        else:
+            window.append(frame)
+            if len(window) <= LAG:
+                continue
+            boxes = detector(window[0], window[-1])
+        with PROFILER.stage('track'):
+            tracker.update(boxes)
+        with PROFILER.stage('draw'):
+            # the frame is still needed as a detection input, draw on a copy
+            image = tracker.draw(frame.image.copy())
+        if on_frame is not None:
+            with PROFILER.stage('write'):
+                on_frame(image)
+        latency.append(time.perf_counter() - captured)
+        PROFILER.frame(frame.index, len(tracker))
+    return latency, late
+
+
+def summarize(latency, source, late, seconds):
+    res = {
+        'read': source.read,
+        'processed': len(latency),
+        'dropped': source.dropped,
+        'late': late,
+        'fps': len(latency) / seconds if seconds > 0 else None,
+    }
+    if latency:
+        ms = np.array(latency) * 1000
+        res['latency_ms'] = {f'p{q}': float(np.percentile(ms, q)) for q in (50, 95, 99)}
+        res['latency_ms']['max'] = float(ms.max())
+    return res
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Detects and tracks cars in a live feed with bounded latency')
+    parser.add_argument('source', nargs='?', default=VIDEO_PATH, help='video file, stream url or camera number')
+    parser.add_argument('--output', default=None, help='video file to record the processed frames to')
+    parser.add_argument('--show', action='store_true', help='show the processed frames in a window')
+    parser.add_argument('--replay', action='store_true', help='read a file at its own fps, as if it was a camera')
+    parser.add_argument('--queue', type=int, default=4, help='frames buffered between reading and processing')
+    parser.add_argument('--max-latency', type=float, default=None,
+                        help='seconds after which a queued frame is skipped instead of processed')
+    parser.add_argument('--report', default=None, help='json file for the latency report')
+    add_pipeline_arguments(parser)
+    args = parser.parse_args()
+
+    PROFILER.enabled = args.profile is not None
+    source = LiveSource(args.source, size=args.queue, replay=args.replay)
+    detector = make_detector(args, width=source.width)
+    out = open_writer((source.width, source.height, source.fps), args.output) if args.output else None
+
+    def on_frame(image):
+        if out is not None:
+            out.write(image)
+        if args.show:
+            cv2.imshow('cars', image)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                source.stopped.set()
+
+    start = time.perf_counter()
+    source.start()
+    try:
+        latency, late = run_live(source, detector, make_tracker(args.tracker), args.max_latency, on_frame)
+    finally:
+        source.stop()
+        if out is not None:
+            out.release()
+        if args.show:
+            cv2.destroyAllWindows()
+
+    report = summarize(latency, source, late, time.perf_counter() - start)
+    print(json.dumps(report, indent=2))
+    if args.profile:
+        PROFILER.report()
+        PROFILER.export(args.profile)
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -1,8 +1,17 @@
+import argparse
+import functools
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import cv2
 from skimage.measure import compare_ssim
 import imutils
 import tqdm
+from frames import Frame, as_gray, iter_frames
+from profiling import PROFILER
+from tracker import Tracker
 
 VIDEO_PATH = 'video.mp4'
 VIDEO_OUTPUT_PATH = 'output.mp4'
@@ -30,17 +39,38 @@ def read_video(path_to_video):
     return res2, (video_width, video_height, fps), res
 
 
-def save_video(frames, vinfo, output_path):
+def video_info(path_to_video):
+    cap = cv2.VideoCapture(path_to_video)
+
+    if not cap.isOpened():
+        raise IOError(f'Could not open {path_to_video}. Check if the path is correct.')
+
+    info = (cap.get(cv2.CAP_PROP_FRAME_WIDTH), cap.get(cv2.CAP_PROP_FRAME_HEIGHT), cap.get(cv2.CAP_PROP_FPS))
+    frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return info, frames
+
+
+def open_writer(vinfo, output_path):
     fourcc = cv2.VideoWriter_fourcc('m', 'p', '4', 'v')
     out = cv2.VideoWriter(output_path, fourcc, vinfo[2], (int(vinfo[0]), int(vinfo[1])))
 
     if not out.isOpened():
         raise IOError(f'Could not open or create the file {output_path}')
+    return out
 
-    for frame in frames:
-        out.write(frame)
 
-    out.release()
+def save_video(frames, vinfo, output_path):
+    '''
+        frames can be any iterable, a generator is encoded as its frames come out.
+    '''
+    out = open_writer(vinfo, output_path)
+    try:
+        for frame in frames:
+            with PROFILER.stage('write'):
+                out.write(frame)
+    finally:
+        out.release()
 
 
 class Car:
@@ -116,49 +146,301 @@ def markCars(frame, cars):
     return frame
 
 
-def diff_frames(frames, c_frames):
+LAG = 10
+THRESHOLD1, THRESHOLD2 = 300, 3000
+BRIDGE_Y1, BRIDGE_Y2 = 130, 240
+KERNEL = np.ones((5, 5), np.uint8)
 
-    res = []
-    threshold1, threshold2 = 300, 3000
-    bridge_y1, bridge_y2 = 130, 240
-    boxes = []
-    cars = []
-    used = []
-    kernel = np.ones((5, 5), np.uint8)
-    for i in tqdm.tqdm(range(len(frames) - 10)):
-        (score, diff) = compare_ssim(frames[i + 10], frames[i], full=True)
+
+def bridge_roi(width, margin=60):
+    '''
+        Region of interest covering the bridge: boxes are only kept if their top is between BRIDGE_Y1 and BRIDGE_Y2,
+        margin leaves room for the rest of the car below BRIDGE_Y2.
+    '''
+    return 0, BRIDGE_Y1, int(width), BRIDGE_Y2 - BRIDGE_Y1 + margin
+
+
+def find_boxes(prev, cur, roi=None, levels=0):
+    '''
+        Bounding boxes (x, y, w, h) of the regions which differ between two gray frames (arrays or Frame objects).
+        roi (x, y, w, h) restricts the detection to a part of the frame, levels halves the resolution
+        that many times (cv2.pyrDown) before comparing. The boxes are in full frame coordinates.
+    '''
+    with PROFILER.stage('gray'):
+        prev, cur = as_gray(prev), as_gray(cur)
+    ox, oy = 0, 0
+    if roi is not None:
+        ox, oy, w, h = roi
+        prev, cur = prev[oy:oy + h, ox:ox + w], cur[oy:oy + h, ox:ox + w]
+    with PROFILER.stage('downscale'):
+        for _ in range(levels):
+            prev, cur = cv2.pyrDown(prev), cv2.pyrDown(cur)
+    f = 1 << levels
+    kernel = KERNEL if levels == 0 else np.ones((max(1, round(5 / f)),) * 2, np.uint8)
+
+    with PROFILER.stage('ssim'):
+        (score, diff) = compare_ssim(cur, prev, full=True)
+    with PROFILER.stage('threshold'):
         diff = np.uint8(diff * 255)
         thresh = cv2.threshold(diff, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
-        thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
-        contours = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return mask_boxes(thresh, kernel, ox, oy, f)
+
+
+def mask_boxes(mask, kernel=KERNEL, ox=0, oy=0, f=1):
+    '''
+        Bounding boxes of the blobs of a binary mask, mapped back to the full frame: mask pixel (x, y)
+        is frame pixel (ox + x * f, oy + y * f). The mask is closed in place.
+    '''
+    with PROFILER.stage('morphology'):
+        cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, dst=mask)
+    with PROFILER.stage('contours'):
+        contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         contours = imutils.grab_contours(contours)
 
+        res = []
         for c in contours:
             (x, y, w, h) = cv2.boundingRect(c)
-            x += 5
-            w -= 5
-            boxes.append(w * h)
-            if threshold1 <= w * h <= threshold2 and bridge_y1 <= y <= bridge_y2:
-                flag = False
-                for ind, car in enumerate(cars):
-                    if (car.intersectionArea((x, y, w, h)) > car.getArea() * 0.25) and (abs(car.y - y) < car.y * 0.1):
-                        flag = True
-                        used[ind] += 1
-                        car.update(x, y, w, h)
-                if not flag:
-                    used.append(1)
-                    cars.append(Car(x, y, w, h))
-        new_cars, new_used = [], []
-        for ind, car in enumerate(cars):
-            if used[ind] > -5:
-                new_cars.append(car)
-                new_used.append(used[ind] - 1)
-        used, cars = new_used, new_cars
-        frame = markCars(c_frames[i], cars)
-        res.append(frame)
+            res.append((ox + x * f + 5, oy + y * f, w * f - 5, h * f))
     return res
 
 
+class BackgroundDetector:
+    '''
+        Detector which compares every frame with an incremental background model instead of computing SSIM:
+            'mog2', 'knn' - OpenCV background subtractors
+            'average'     - running average of the frames, the difference is thresholded at threshold
+        All buffers are allocated on the first frame and reused. The model has to see the frames in order,
+        so it is called once per frame and only looks at prev, the frame the boxes are drawn on.
+    '''
+    stateful = True
+
+    def __init__(self, kind='mog2', roi=None, alpha=0.02, threshold=30):
+        self.kind = kind
+        self.roi = roi
+        self.alpha = alpha
+        self.threshold = threshold
+        if kind == 'mog2':
+            self.model = cv2.createBackgroundSubtractorMOG2(detectShadows=False)
+        elif kind == 'knn':
+            self.model = cv2.createBackgroundSubtractorKNN(detectShadows=False)
+        elif kind != 'average':
+            raise ValueError(f'Unknown background model {kind}')
+        self.mask = None
+
+    def __call__(self, prev, cur):
+        ox, oy = 0, 0
+        with PROFILER.stage('gray'):
+            frame = as_gray(prev)
+        if self.roi is not None:
+            ox, oy, w, h = self.roi
+            frame = frame[oy:oy + h, ox:ox + w]
+
+        if self.mask is None:
+            self.mask = np.zeros(frame.shape, np.uint8)
+            self.diff = np.zeros(frame.shape, np.uint8)
+            self.background8 = frame.copy()
+            self.background = frame.astype(np.float32)
+
+        with PROFILER.stage('background'):
+            if self.kind == 'average':
+                cv2.absdiff(frame, self.background8, dst=self.diff)
+                cv2.threshold(self.diff, self.threshold, 255, cv2.THRESH_BINARY, dst=self.mask)
+                cv2.accumulateWeighted(frame, self.background, self.alpha)
+                cv2.convertScaleAbs(self.background, dst=self.background8)
+            else:
+                self.model.apply(frame, fgmask=self.mask)
+        return mask_boxes(self.mask, KERNEL, ox, oy)
+
+
+def is_candidate(box):
+    x, y, w, h = box
+    return THRESHOLD1 <= w * h <= THRESHOLD2 and BRIDGE_Y1 <= y <= BRIDGE_Y2
+
+
+def track(cars, used, boxes):
+    '''
+        Matches the boxes found in a frame with the tracked cars, returns the new cars and used lists.
+    '''
+    for (x, y, w, h) in boxes:
+        if is_candidate((x, y, w, h)):
+            flag = False
+            for ind, car in enumerate(cars):
+                if (car.intersectionArea((x, y, w, h)) > car.getArea() * 0.25) and (abs(car.y - y) < car.y * 0.1):
+                    flag = True
+                    used[ind] += 1
+                    car.update(x, y, w, h)
+            if not flag:
+                used.append(1)
+                cars.append(Car(x, y, w, h))
+    new_cars, new_used = [], []
+    for ind, car in enumerate(cars):
+        if used[ind] > -5:
+            new_cars.append(car)
+            new_used.append(used[ind] - 1)
+    return new_cars, new_used
+
+
+class CarTracker:
+    '''
+        The list of Car objects behind the same interface as tracker.Tracker.
+    '''
+
+    def __init__(self):
+        self.cars, self.used = [], []
+
+    def __len__(self):
+        return len(self.cars)
+
+    def update(self, boxes):
+        self.cars, self.used = track(self.cars, self.used, boxes)
+
+    def draw(self, frame):
+        return markCars(frame, self.cars)
+
+
+def make_tracker(kind='cars'):
+    if kind == 'vector':
+        return Tracker(keep=is_candidate)
+    return CarTracker()
+
+
+def diff_frames_stream(frames, total=None, detector=find_boxes, tracker=None):
+    '''
+        Streaming version of diff_frames. frames is an iterable of Frame objects (e.g. iter_frames with a pool
+        of at least LAG + 2), output frames are yielded as soon as the frame LAG frames later is read.
+        Only the last LAG + 1 frames are kept in memory. Cars are drawn into the frame's own image,
+        with pooled frames it is reused later, so copy it to keep it.
+        detector(prev, cur) returns the boxes of a frame pair, e.g. find_boxes with a roi.
+        tracker is a CarTracker (the default) or a tracker.Tracker.
+    '''
+    window = deque(maxlen=LAG + 1)
+    tracker = tracker or CarTracker()
+    for frame in tqdm.tqdm(PROFILER.iterate('read', frames), total=total):
+        window.append(frame)
+        if len(window) <= LAG:
+            # every row has the read of the frame LAG later, not the warm-up ones
+            PROFILER.skip_row()
+            continue
+        boxes = detector(window[0], window[-1])
+        with PROFILER.stage('track'):
+            tracker.update(boxes)
+        with PROFILER.stage('draw'):
+            image = tracker.draw(window[0].image)
+        yield image
+        # the row is closed once the consumer wrote the frame, before the next read
+        PROFILER.frame(window[0].index, len(tracker))
+
+
+def diff_frames(frames, c_frames):
+    frames = (Frame(color, gray, i) for i, (gray, color) in enumerate(zip(frames, c_frames)))
+    return list(diff_frames_stream(frames, total=len(c_frames)))
+
+
+def detect_range(path_to_video, start, stop, detector=find_boxes):
+    '''
+        Boxes of the output frames start..stop - 1, frames start..stop + LAG - 1 are decoded in this process.
+        The stateless part of the pipeline, runs in the pool workers of detect_parallel.
+    '''
+    res = []
+    window = deque(maxlen=LAG + 1)
+    frames = iter_frames(path_to_video, pool_size=LAG + 2, start=start)
+    for frame in itertools.islice(frames, stop - start + LAG):
+        window.append(frame)
+        if len(window) > LAG:
+            res.append(detector(window[0], window[-1]))
+    frames.close()
+    return res
+
+
+def detect_parallel(path_to_video, total, workers=None, chunk=100, detector=find_boxes):
+    '''
+        Yields the boxes of every output frame in order, the frames are split into chunks of chunk
+        frames which are processed by a pool of workers processes.
+    '''
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(detect_range, path_to_video, i, min(i + chunk, total - LAG), detector)
+                   for i in range(0, total - LAG, chunk)]
+        for future in futures:
+            yield from future.result()
+
+
+def render(path_to_video, boxes, total=None, tracker=None):
+    '''
+        The sequential part: tracks the cars through the boxes of every frame in order and draws them.
+    '''
+    tracker = tracker or CarTracker()
+    frames = PROFILER.iterate('read', iter_frames(path_to_video))
+    for frame_boxes, frame in zip(tqdm.tqdm(boxes, total=total), frames):
+        with PROFILER.stage('track'):
+            tracker.update(frame_boxes)
+        with PROFILER.stage('draw'):
+            image = tracker.draw(frame.image)
+        yield image
+        PROFILER.frame(frame.index, len(tracker))
+
+
+def process_video(path_to_video, output_path, workers=1, detector=find_boxes, tracker=None):
+    '''
+        Reads, processes and writes the video frame by frame, memory use does not depend on its length.
+        With workers > 1 the detection runs in a process pool and only the tracking stays sequential.
+    '''
+    info, total = video_info(path_to_video)
+    # a background model has to see all the frames in order, it can't be split over workers
+    if workers > 1 and not getattr(detector, 'stateful', False):
+        boxes = detect_parallel(path_to_video, total, workers, detector=detector)
+        frames = render(path_to_video, boxes, total=total - LAG, tracker=tracker)
+    else:
+        frames = iter_frames(path_to_video, pool_size=LAG + 2)
+        frames = diff_frames_stream(frames, total=total, detector=detector, tracker=tracker)
+    save_video(frames, info, output_path)
+
+
+def parse_roi(roi, width):
+    if roi is None:
+        return None
+    if roi == 'bridge':
+        return bridge_roi(width)
+    return tuple(int(v) for v in roi.split(','))
+
+
+def add_pipeline_arguments(parser, profile=True):
+    parser.add_argument('--roi', default=None,
+                        help='region of interest for the detection: x,y,w,h or "bridge"; the whole frame by default')
+    parser.add_argument('--levels', type=int, default=0, help='pyramid levels to downscale the detection by')
+    parser.add_argument('--detector', choices=['ssim', 'mog2', 'knn', 'average'], default='ssim',
+                        help='SSIM between frames i and i + 10 or an incremental background model')
+    parser.add_argument('--tracker', choices=['vector', 'cars'], default='vector',
+                        help='numpy tracker with Hungarian matching or the list of Car objects')
+    if profile:
+        parser.add_argument('--profile', default=None,
+                            help='time the stages of the pipeline and write the summary to a .json or the '
+                                 'per-frame timings to a .csv file')
+
+
+def make_detector(args, width=None):
+    if args.roi is None and args.levels == 0 and args.detector == 'ssim':
+        return find_boxes
+    if width is None:
+        (width, _, _), _ = video_info(args.input)
+    roi = parse_roi(args.roi, width)
+    if args.detector != 'ssim':
+        return BackgroundDetector(args.detector, roi=roi)
+    return functools.partial(find_boxes, roi=roi, levels=args.levels)
+
+
 if __name__ == '__main__':
-    video_frames, info, color_frames = read_video(VIDEO_PATH)
-    save_video(diff_frames(video_frames, color_frames), info, output_path=VIDEO_OUTPUT_PATH)
+    parser = argparse.ArgumentParser(description='Detects and tracks cars in a video')
+    parser.add_argument('input', nargs='?', default=VIDEO_PATH)
+    parser.add_argument('output', nargs='?', default=VIDEO_OUTPUT_PATH)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='detection processes, 1 to run serially')
+    add_pipeline_arguments(parser)
+    args = parser.parse_args()
+    if args.profile:
+        PROFILER.enabled = True
+        # the detection stages would be timed in the pool workers and lost
+        args.workers = 1
+    process_video(args.input, args.output, workers=args.workers, detector=make_detector(args),
+                  tracker=make_tracker(args.tracker))
+    if args.profile:
+        PROFILER.report()
+        PROFILER.export(args.profile)
@@ -0,0 +1,142 @@
+import contextlib
+import csv
+import json
+import time
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, memory is not reported there
+    resource = None
+
+# histogram bin edges in milliseconds, log spaced from 10 us to 10 s
+BINS_MS = np.logspace(-2, 4, 25)
+
+
+def peak_rss():
+    '''
+        High-water mark of the resident memory of the process in MB.
+    '''
+    if resource is None:
+        return None
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Timer:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, time.perf_counter() - self.start)
+
+
+class Profiler:
+    '''
+        Per-stage timings of the pipeline. Code is instrumented with
+            with PROFILER.stage('ssim'):
+                ...
+        and frame() closes the row of the current output frame, with the number of tracked cars and
+        the memory high-water mark. When disabled, stage returns a shared no-op context manager,
+        so the instrumentation costs an attribute lookup per stage.
+    '''
+    NOOP = contextlib.nullcontext()
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.times = {}
+        self.rows = []
+        self.row = {}
+
+    def stage(self, name):
+        if not self.enabled:
+            return self.NOOP
+        return Timer(self, name)
+
+    def add(self, name, seconds):
+        self.times.setdefault(name, []).append(seconds)
+        self.row[name] = self.row.get(name, 0.0) + seconds
+
+    def iterate(self, name, iterable):
+        '''
+            Times every next() of iterable as stage name, e.g. the decoding of the frames.
+        '''
+        if not self.enabled:
+            return iterable
+        return self._iterate(name, iterable)
+
+    def _iterate(self, name, iterable):
+        it = iter(iterable)
+        while True:
+            with self.stage(name):
+                item = next(it, None)
+            if item is None:
+                return
+            yield item
+
+    def skip_row(self):
+        '''
+            Drops the times of the current row, e.g. the reads before the first output frame.
+            They are still counted in the totals.
+        '''
+        self.row = {}
+
+    def frame(self, index, cars=None):
+        if not self.enabled:
+            return
+        row = {'frame': index, 'cars': cars, 'rss_mb': peak_rss()}
+        row.update((name, seconds * 1000) for name, seconds in self.row.items())
+        self.rows.append(row)
+        self.row = {}
+
+    def summary(self):
+        stages = {}
+        for name, values in self.times.items():
+            ms = np.array(values) * 1000
+            counts, _ = np.histogram(ms, BINS_MS)
+            stages[name] = {
+                'count': len(ms),
+                'total_s': float(ms.sum() / 1000),
+                'mean_ms': float(ms.mean()),
+                'p50_ms': float(np.percentile(ms, 50)),
+                'p95_ms': float(np.percentile(ms, 95)),
+                'p99_ms': float(np.percentile(ms, 99)),
+                'max_ms': float(ms.max()),
+                'histogram': {'edges_ms': BINS_MS.tolist(), 'counts': counts.tolist()},
+            }
+        cars = [row['cars'] for row in self.rows if row['cars'] is not None]
+        return {
+            'frames': len(self.rows),
+            'stages': stages,
+            'cars': {'mean': float(np.mean(cars)), 'max': int(max(cars))} if cars else None,
+            'peak_rss_mb': peak_rss(),
+        }
+
+    def export(self, path):
+        '''
+            The summary as json, or one row per frame with the milliseconds of every stage as csv.
+        '''
+        if path.endswith('.csv'):
+            columns = ['frame', 'cars', 'rss_mb'] + sorted(self.times)
+            with open(path, 'w', newline='') as f:
+                writer = csv.DictWriter(f, columns, restval='')
+                writer.writeheader()
+                writer.writerows(self.rows)
+        else:
+            with open(path, 'w') as f:
+                json.dump(self.summary(), f, indent=2)
+
+    def report(self):
+        for name, s in sorted(self.summary()['stages'].items(), key=lambda item: -item[1]['total_s']):
+            print(f'{name:12} {s["count"]:7} calls {s["total_s"]:8.2f} s  mean {s["mean_ms"]:7.2f} ms  '
+                  f'p95 {s["p95_ms"]:7.2f} ms  max {s["max_ms"]:7.2f} ms')
+
+
+PROFILER = Profiler()
@@ -0,0 +1,98 @@
+import numpy as np
+import cv2
+from scipy.optimize import linear_sum_assignment
+
+MAX_POINTS = 512
+
+
+class Tracker:
+    '''
+        Car tracker keeping the state of all cars in numpy arrays instead of a list of Car objects:
+            boxes  - (n, 4) x, y, w, h of every car
+            used   - (n,) how many frames the car was seen, minus the frames since it was created
+            points - (n, MAX_POINTS, 2) trajectory of every car, lengths holds the number of points
+        Detections are assigned to cars one to one with the Hungarian algorithm on the overlap matrix,
+        gated the same way as Car matching (overlap over a quarter of the car, similar y).
+    '''
+
+    def __init__(self, keep=None):
+        self.keep = keep
+        self.boxes = np.zeros((0, 4), np.int64)
+        self.used = np.zeros(0, np.int64)
+        self.points = np.zeros((0, MAX_POINTS, 2), np.int64)
+        self.lengths = np.zeros(0, np.int64)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def overlap(self, dets):
+        '''
+            (cars, detections) matrix of intersection areas.
+        '''
+        a, b = self.boxes[:, None, :], dets[None, :, :]
+        w = np.minimum(a[..., 0] + a[..., 2], b[..., 0] + b[..., 2]) - np.maximum(a[..., 0], b[..., 0])
+        h = np.minimum(a[..., 1] + a[..., 3], b[..., 1] + b[..., 3]) - np.maximum(a[..., 1], b[..., 1])
+        return np.clip(w, 0, None) * np.clip(h, 0, None)
+
+    def update(self, boxes):
+        if self.keep is not None:
+            boxes = [box for box in boxes if self.keep(box)]
+        dets = np.array(boxes, np.int64).reshape(-1, 4)
+        matched = np.zeros(len(dets), bool)
+
+        if len(self) > 0 and len(dets) > 0:
+            inter = self.overlap(dets)
+            area = self.boxes[:, 2] * self.boxes[:, 3]
+            y = self.boxes[:, 1]
+            gate = (inter > area[:, None] * 0.25) & (np.abs(y[:, None] - dets[None, :, 1]) < y[:, None] * 0.1)
+            cost = np.where(gate, -inter / np.maximum(area, 1)[:, None], 1.0)
+            rows, cols = linear_sum_assignment(cost)
+            ok = gate[rows, cols]
+            rows, cols = rows[ok], cols[ok]
+            matched[cols] = True
+
+            cars, d = self.boxes[rows], dets[cols]
+            cars[:, :2] = (cars[:, :2] + d[:, :2]) // 2
+            cars[:, 2:] = (3 * cars[:, 2:] + d[:, 2:]) // 4
+            self.boxes[rows] = cars
+            self.used[rows] += 1
+            self._append_points(rows)
+
+        new = dets[~matched]
+        if len(new) > 0:
+            self.boxes = np.concatenate([self.boxes, new])
+            self.used = np.concatenate([self.used, np.ones(len(new), np.int64)])
+            self.points = np.concatenate([self.points, np.zeros((len(new), MAX_POINTS, 2), np.int64)])
+            self.lengths = np.concatenate([self.lengths, np.zeros(len(new), np.int64)])
+
+        alive = self.used > -5
+        self.boxes, self.used = self.boxes[alive], self.used[alive] - 1
+        self.points, self.lengths = self.points[alive], self.lengths[alive]
+
+    def _append_points(self, rows):
+        full = rows[self.lengths[rows] == MAX_POINTS]
+        if len(full) > 0:
+            self.points[full, :-1] = self.points[full, 1:]
+            self.lengths[full] -= 1
+        self.points[rows, self.lengths[rows]] = self.boxes[rows, :2]
+        self.lengths[rows] += 1
+
+    def draw(self, frame):
+        '''
+            Same drawing as markCars: car boxes and the trajectory of the back of every moving car.
+            Trajectories are drawn with cv2.polylines on a mask, the parts inside any car are masked out.
+        '''
+        occlusion = np.zeros(frame.shape[:2], np.uint8)
+        tracks = np.zeros(frame.shape[:2], np.uint8)
+        for (x, y, w, h), pts, n in zip(self.boxes.tolist(), self.points, self.lengths.tolist()):
+            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 0, 255), 2)
+            cv2.rectangle(occlusion, (x, y), (x + w, y + h), 255, -1)
+            if n < 5 or pts[n - 1, 0] == pts[0, 0]:
+                continue
+            line = pts[:n].copy()
+            if pts[n - 1, 0] < pts[0, 0]:
+                line[:, 0] += w
+            line[:, 1] = (2 * line[:, 1] + h) // 2
+            cv2.polylines(tracks, [line.astype(np.int32)], False, 255, 2)
+        frame[(tracks > 0) & (occlusion == 0)] = (255, 0, 0)
+        return frame
@@ -0,0 +1,275 @@
+import random
+
+EMPTY = -1
+# matrix value stored in each layer of Board.masks: live dots, captured cells, used up dots
+VALUES = [0, 1, 2, 3, -2, -3]
+DOTS, CAPTURED, WALLS = 0, 2, 4
+
+_zobrist = {}
+
+
+def popcount(b):
+    return bin(b).count('1')
+
+
+def zobrist_keys(size):
+    if size not in _zobrist:
+        rng = random.Random(size)
+        _zobrist[size] = [rng.getrandbits(64) for _ in range(len(VALUES) * size)]
+    return _zobrist[size]
+
+
+class Board:
+    '''
+        Compact board of the dots game. Every cell state is kept as an integer bitboard in masks:
+            masks[DOTS + p]     - live dots of player p (matrix value p)
+            masks[CAPTURED + p] - cells captured by player p (matrix value p + 2)
+            masks[WALLS + p]    - dots of player p used up by a cycle (matrix value -(p + 2))
+        Cell (x, y) is bit x * stride + y. The stride is m + 1, so there is an empty guard column
+        after every row and shifted masks never wrap from one row into the next.
+        hash is the Zobrist hash of the position and is updated only for the bits that change.
+    '''
+
+    def __init__(self, n, m):
+        self.n = n
+        self.m = m
+        self.stride = m + 1
+        self.size = n * self.stride
+        row = (1 << m) - 1
+        self.full = 0
+        self.edge = row | (row << ((n - 1) * self.stride))
+        for i in range(n):
+            self.full |= row << (i * self.stride)
+            self.edge |= self.bit(i, 0) | self.bit(i, m - 1)
+        self.masks = [0] * len(VALUES)
+        self.keys = zobrist_keys(self.size)
+        self.hash = 0
+        # states before the moves done with make_move, for unmake_move
+        self.history = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['keys']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.keys = zobrist_keys(self.size)
+
+    def copy(self):
+        b = Board.__new__(Board)
+        b.__dict__.update(self.__dict__)
+        b.masks = self.masks[:]
+        b.history = []
+        return b
+
+    @classmethod
+    def from_matrix(cls, matrix):
+        b = cls(len(matrix), len(matrix[0]))
+        for i, row in enumerate(matrix):
+            for j, v in enumerate(row):
+                if v != EMPTY:
+                    b.set_cell(i, j, v)
+        return b
+
+    def to_matrix(self):
+        res = [[EMPTY] * self.m for _ in range(self.n)]
+        for layer, mask in enumerate(self.masks):
+            for x, y in self.cells(mask):
+                res[x][y] = VALUES[layer]
+        return res
+
+    def bit(self, x, y):
+        return 1 << (x * self.stride + y)
+
+    def indices(self, mask):
+        while mask:
+            low = mask & -mask
+            yield low.bit_length() - 1
+            mask ^= low
+
+    def cells(self, mask):
+        for i in self.indices(mask):
+            yield divmod(i, self.stride)
+
+    def dots(self, p):
+        return self.masks[DOTS + p]
+
+    def occupied(self):
+        res = 0
+        for mask in self.masks:
+            res |= mask
+        return res
+
+    def free(self):
+        return self.full & ~self.occupied()
+
+    def free_cells(self):
+        return list(self.cells(self.free()))
+
+    def score(self):
+        return popcount(self.masks[CAPTURED]), popcount(self.masks[CAPTURED + 1])
+
+    def _put(self, layer, value):
+        changed = self.masks[layer] ^ value
+        self.masks[layer] = value
+        offset = layer * self.size
+        for i in self.indices(changed):
+            self.hash ^= self.keys[offset + i]
+
+    def _clear(self, mask):
+        for layer, value in enumerate(self.masks):
+            if value & mask:
+                self._put(layer, value & ~mask)
+
+    def set_cell(self, x, y, value):
+        b = self.bit(x, y)
+        self._clear(b)
+        if value != EMPTY:
+            layer = value if value >= 0 else 2 - value
+            self._put(layer, self.masks[layer] | b)
+
+    def spread(self, mask):
+        '''
+            mask together with all its 8-neighbours
+        '''
+        s = self.stride
+        h = mask | (mask << 1) | (mask >> 1)
+        return (h | (h << s) | (h >> s)) & self.full
+
+    def spread4(self, mask):
+        '''
+            mask together with its 4-neighbours
+        '''
+        s = self.stride
+        return (mask | (mask << 1) | (mask >> 1) | (mask << s) | (mask >> s)) & self.full
+
+    def near(self, mask, radius):
+        for _ in range(radius):
+            mask = self.spread(mask)
+        return mask
+
+    def enclosed(self, walls):
+        '''
+            Cells which can't be reached from the edge of the board by 4-steps avoiding walls.
+            Dots of walls connected diagonally block the way too.
+        '''
+        allowed = self.full & ~walls
+        return allowed & ~self._flood4(self.edge & allowed, allowed)
+
+    def _flood4(self, seed, allowed):
+        res = seed
+        while True:
+            nxt = self.spread4(res) & allowed
+            if nxt == res:
+                return res
+            res = nxt
+
+    def _fill(self, seed, allowed):
+        res = seed
+        while True:
+            nxt = res | (self.spread(res) & allowed)
+            if nxt == res:
+                return res
+            res = nxt
+
+    def _path(self, a, b, allowed):
+        '''
+            Shortest 8-connected path from a to b inside allowed that does not use the direct edge a - b,
+            found by a bit-parallel BFS. Returns the list of single-bit masks from a to b or None.
+        '''
+        layers = [a]
+        seen = a
+        frontier = self.spread(a) & allowed & ~a & ~b
+        while frontier:
+            layers.append(frontier)
+            seen |= frontier
+            frontier = self.spread(frontier) & allowed & ~seen
+            if frontier & b:
+                path = [b]
+                cur = b
+                for layer in reversed(layers):
+                    step = self.spread(cur) & layer
+                    cur = step & -step
+                    path.append(cur)
+                path.reverse()
+                return path
+        return None
+
+    def find_cycle(self, x, y, p):
+        '''
+            Looks for a cycle of at least 4 live dots of player p that passes through (x, y).
+            Only the chains touching (x, y) are explored.
+        '''
+        v = self.bit(x, y)
+        chain = self.dots(p) & ~v
+        around = list(self.cells(self.spread(v) & chain))
+        for i, (ax, ay) in enumerate(around):
+            a = self.bit(ax, ay)
+            component = self._fill(a, chain)
+            for bx, by in around[i + 1:]:
+                b = self.bit(bx, by)
+                if not b & component:
+                    continue
+                path = self._path(a, b, chain)
+                if path is not None:
+                    return [v] + path
+        return None
+
+    def interior(self, path):
+        '''
+            Cells enclosed by the cycle (a mask). The cells of the cycle's bounding box are flood filled from
+            the box border by 4-steps, the cycle blocks the fill, whatever is not reached is inside.
+            Concave cycles and cycles around other cycles are handled, the cost is linear in the box area.
+        '''
+        cells = list(self.cells(path))
+        x0, x1 = min(x for x, _ in cells), max(x for x, _ in cells)
+        y0, y1 = min(y for _, y in cells), max(y for _, y in cells)
+        row = ((1 << (y1 - y0 + 1)) - 1) << y0
+        box = 0
+        for x in range(x0, x1 + 1):
+            box |= row << (x * self.stride)
+        edge = (row << (x0 * self.stride)) | (row << (x1 * self.stride))
+        for x in range(x0, x1 + 1):
+            edge |= self.bit(x, y0) | self.bit(x, y1)
+        allowed = box & ~path
+        return allowed & ~self._flood4(edge & allowed, allowed)
+
+    def capture(self, x, y, p):
+        '''
+            Runs the capture for the dot of player p just placed at (x, y).
+            Returns the mask of the newly captured cells or None if no cycle goes through (x, y).
+        '''
+        cycle = self.find_cycle(x, y, p)
+        if cycle is None:
+            return None
+        path = 0
+        for b in cycle:
+            path |= b
+        inside = self.interior(path)
+        self._clear(inside | path)
+        self._put(CAPTURED + p, self.masks[CAPTURED + p] | inside)
+        self._put(WALLS + p, self.masks[WALLS + p] | path)
+        return inside
+
+    def play(self, x, y, p):
+        self.set_cell(x, y, p)
+        return self.capture(x, y, p)
+
+    def make_move(self, x, y, p):
+        '''
+            play which can be taken back by unmake_move. The cells the move changes (the dot, the captured
+            area and the used up cycle) are restored from the layer masks saved before the move.
+        '''
+        self.history.append((tuple(self.masks), self.hash))
+        return self.play(x, y, p)
+
+    def unmake_move(self):
+        masks, self.hash = self.history.pop()
+        self.masks[:] = masks
+
+    def capture_all(self):
+        for p in range(2):
+            for x, y in list(self.cells(self.dots(p))):
+                if self.dots(p) & self.bit(x, y):
+                    self.capture(x, y, p)
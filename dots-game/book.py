@@ -0,0 +1,187 @@
+import argparse
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from board import Board, popcount
+from search import AlphaBeta
+
+# next to the module, wherever the game is started from
+BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'book.sqlite')
+
+
+def transforms(n, m):
+    '''
+        Symmetries of the board as (transpose, flip x, flip y). Rotations by 90 degrees and the diagonal
+        reflections only keep the shape of square boards.
+    '''
+    res = []
+    for swap in ((False, True) if n == m else (False,)):
+        for fx in (False, True):
+            for fy in (False, True):
+                res.append((swap, fx, fy))
+    return res
+
+
+def apply(t, x, y, n, m):
+    swap, fx, fy = t
+    if fx:
+        x = n - 1 - x
+    if fy:
+        y = m - 1 - y
+    if swap:
+        x, y = y, x
+    return x, y
+
+
+def invert(t, x, y, n, m):
+    swap, fx, fy = t
+    if swap:
+        x, y = y, x
+    if fx:
+        x = n - 1 - x
+    if fy:
+        y = m - 1 - y
+    return x, y
+
+
+def canonical(board, p):
+    '''
+        Key of the position that is the same for all its rotations and reflections,
+        together with the symmetry mapping the board to the canonical one.
+    '''
+    n, m = board.n, board.m
+    matrix = board.to_matrix()
+    best = None
+    for t in transforms(n, m):
+        cells = bytearray([n, m, p])
+        for x in range(n):
+            for y in range(m):
+                i, j = invert(t, x, y, n, m)
+                cells.append(matrix[i][j] + 3)
+        key = bytes(cells)
+        if best is None or key < best[0]:
+            best = (key, t)
+    return best
+
+
+class PositionCache:
+    '''
+        Best moves of searched positions in an SQLite file, keyed by the canonical position,
+        with an LRU dict of the most recently used entries in front of it.
+        Moves are kept in the coordinates of the canonical board. Safe to use from several threads.
+    '''
+
+    def __init__(self, path=BOOK_PATH, capacity=100000):
+        self.capacity = capacity
+        self.front = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS positions '
+                        '(key BLOB PRIMARY KEY, x INTEGER, y INTEGER, value INTEGER, depth INTEGER)')
+        self.db.commit()
+
+    def _lookup(self, key):
+        if key in self.front:
+            self.front.move_to_end(key)
+            return self.front[key]
+        row = self.db.execute('SELECT x, y, value, depth FROM positions WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            self._remember(key, row)
+        return row
+
+    def _remember(self, key, entry):
+        self.front[key] = entry
+        self.front.move_to_end(key)
+        if len(self.front) > self.capacity:
+            self.front.popitem(last=False)
+
+    def get(self, board, p, min_depth=0):
+        '''
+            (move, value, depth) stored for player p to move, if it was searched at least min_depth plies deep
+            or down to the end of the game.
+        '''
+        key, t = canonical(board, p)
+        with self.lock:
+            entry = self._lookup(key)
+        if entry is None or entry[3] < min(min_depth, popcount(board.free())):
+            self.misses += 1
+            return None
+        self.hits += 1
+        x, y, value, depth = entry
+        return invert(t, x, y, board.n, board.m), value, depth
+
+    def put(self, board, p, move, value, depth):
+        key, t = canonical(board, p)
+        x, y = apply(t, move[0], move[1], board.n, board.m)
+        with self.lock:
+            old = self._lookup(key)
+            if old is not None and old[3] >= depth:
+                return
+            self._remember(key, (x, y, value, depth))
+            self.db.execute('INSERT OR REPLACE INTO positions VALUES (?, ?, ?, ?, ?)', (key, x, y, value, depth))
+            self.db.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM positions').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def build_book(cache, board, engine, agent, to_move, plies):
+    '''
+        Stores the agent's move for every position reachable in plies moves of the opponent.
+        All opponent replies are tried, up to symmetry; the agent answers with its best move.
+    '''
+    if plies < 0 or board.free() == 0:
+        return
+    if to_move == agent:
+        hit = cache.get(board, agent, engine.max_depth or 0)
+        if hit is None:
+            move, value = engine.search(board, agent)
+            cache.put(board, agent, move, value, engine.depth)
+        else:
+            move = hit[0]
+        child = board.copy()
+        child.play(move[0], move[1], agent)
+        build_book(cache, child, engine, agent, 1 - agent, plies)
+        return
+
+    seen = set()
+    for x, y in board.free_cells():
+        child = board.copy()
+        child.play(x, y, to_move)
+        key, _ = canonical(child, agent)
+        if key in seen:
+            continue
+        seen.add(key)
+        build_book(cache, child, engine, agent, agent, plies - 1)
+
+
+def parse_size(s):
+    n, m = s.lower().split('x')
+    return int(n), int(m)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precomputes the opening book of the dots-game agent')
+    parser.add_argument('--size', type=parse_size, action='append', help='board size in points, e.g. 4x4')
+    parser.add_argument('--plies', type=int, default=1, help='number of opponent moves to cover')
+    parser.add_argument('--time-limit', type=float, default=2.0, help='seconds per position')
+    parser.add_argument('--max-depth', type=int, default=None)
+    parser.add_argument('--path', default=BOOK_PATH)
+    args = parser.parse_args()
+
+    cache = PositionCache(args.path)
+    for n, m in args.size or [(4, 4)]:
+        engine = AlphaBeta(time_limit=args.time_limit, max_depth=args.max_depth, seed=0)
+        # in the Tk game the player moves first and the agent plays 0, cover both orders
+        for first in (1, 0):
+            build_book(cache, Board(n, m), engine, 0, first, args.plies)
+        print(f'{n}x{m}: {len(cache)} positions in {args.path}')
+    cache.close()
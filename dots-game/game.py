@@ -0,0 +1,165 @@
+import random
+from board import Board
+from search import AlphaBeta
+from mcts import MCTS
+
+
+class Move:
+    def __init__(self, x, y, p):
+        self.x = x
+        self.y = y
+        self.p = p
+
+
+class Moves:
+    def __init__(self):
+        self.moves = []
+
+    def add(self, move: Move):
+        self.moves.append(move)
+
+    def getMoves(self):
+        return self.moves
+
+    def pop(self):
+        return self.moves.pop()
+
+
+class Game:
+    def __init__(self, n, m):
+        self.n = n
+        self.m = m
+        self.moves = Moves()
+        self.board = Board(n, m)
+
+    @property
+    def matrix(self):
+        return self.board.to_matrix()
+
+    def is_valid(self, x, y):
+        return 0 <= x < self.n and 0 <= y < self.m
+
+    def evaluate(self, matrix):
+        agent, player = 0, 0
+        for i in range(self.n):
+            for j in range(self.m):
+                if matrix[i][j] == 2:
+                    agent += 1
+
+                if matrix[i][j] == 3:
+                    player += 1
+
+        return agent, player
+
+    def getAvailablePositions(self, matrix):
+        res = []
+        for i in range(self.n):
+            for j in range(self.m):
+                if matrix[i][j] == -1:
+                    res.append((i, j))
+        return res
+
+    def fix_matrix(self, matrix):
+        board = Board.from_matrix(matrix)
+        board.capture_all()
+        fixed = board.to_matrix()
+        for i in range(self.n):
+            matrix[i][:] = fixed[i]
+
+    def addMove(self, x, y, p):
+        print('new move added to game')
+        self.moves.add(Move(x, y, p))
+        self.board.play(x, y, p)
+
+    def make_move(self, x, y, p):
+        '''
+            Like addMove, but the move can be taken back with unmake_move.
+        '''
+        self.moves.add(Move(x, y, p))
+        return self.board.make_move(x, y, p)
+
+    def unmake_move(self):
+        self.moves.pop()
+        self.board.unmake_move()
+
+    def getMoves(self):
+        return self.moves
+
+
+class Agent:
+    def __init__(self, n, m, game, time_limit=1.0, max_depth=None, seed=None, workers=1, player=0,
+                 cache=None, min_depth=4):
+        '''
+            cache is an optional book.PositionCache, its moves are used if they were searched
+            at least min_depth plies deep.
+        '''
+        self.n = n
+        self.m = m
+        self.game = game
+        self.player = player
+        self.cache = cache
+        self.min_depth = min_depth
+        self.search = AlphaBeta(time_limit=time_limit, max_depth=max_depth, seed=seed, workers=workers)
+
+    def findBestMove(self, matrix):
+        board = Board.from_matrix(matrix)
+        if self.cache is not None:
+            hit = self.cache.get(board, self.player, self.min_depth)
+            if hit is not None:
+                print(f'best move: {hit[0]} from cache, value: {hit[1]}, depth: {hit[2]}')
+                return hit[0]
+        bestMove, value = self.search.search(board, self.player)
+        print(f'best move: {bestMove}, value: {value}, depth: {self.search.depth}, nodes: {self.search.nodes}')
+        if self.cache is not None and bestMove is not None and not self.search.stopped:
+            self.cache.put(board, self.player, bestMove, value, self.search.depth)
+        return bestMove
+
+    def make_a_move(self, game_matrix):
+        bestMove = self.findBestMove(game_matrix)
+        return bestMove
+
+    def stop(self):
+        self.search.stop()
+
+
+class MCTSAgent:
+    def __init__(self, n, m, game, time_limit=1.0, iterations=None, batch=16, seed=None, player=0):
+        self.n = n
+        self.m = m
+        self.game = game
+        self.player = player
+        self.search = MCTS(time_limit=time_limit, iterations=iterations, batch=batch, seed=seed)
+
+    def findBestMove(self, matrix):
+        board = Board.from_matrix(matrix)
+        bestMove, value = self.search.search(board, self.player)
+        print(f'best move: {bestMove}, win rate: {value:.2f}, depth: {self.search.depth}, playouts: {self.search.nodes}')
+        return bestMove
+
+    def make_a_move(self, game_matrix):
+        bestMove = self.findBestMove(game_matrix)
+        return bestMove
+
+    def stop(self):
+        self.search.stop()
+
+
+class RandomAgent:
+    def __init__(self, n, m, game, seed=None, player=0):
+        self.n = n
+        self.m = m
+        self.game = game
+        self.player = player
+        self.rng = random.Random(seed)
+
+    def findBestMove(self, matrix):
+        t = self.game.getAvailablePositions(matrix)
+        if len(t) == 0:
+            return None
+        return self.rng.choice(t)
+
+    def make_a_move(self, game_matrix):
+        return self.findBestMove(game_matrix)
+
+    def stop(self):
+        pass
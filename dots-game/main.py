@@ -1,198 +1,22 @@
 from tkinter import *
-from copy import deepcopy
-import random
-
-
-class Move:
-    def __init__(self, x, y, p):
-        self.x = x
-        self.y = y
-        self.p = p
-
-
-class Moves:
-    def __init__(self):
-        self.moves = []
-
-    def add(self, move: Move):
-        self.moves.append(move)
-
-    def getMoves(self):
-        return self.moves
-
-
-class Game:
-    def __init__(self, n, m):
-        self.n = n
-        self.m = m
-        self.moves = Moves()
-        self.matrix = []
-        for i in range(n):
-            self.matrix.append([-1 for _ in range(m)])
-        self.next = [[1, 0], [1, 1], [0, 1], [-1, 1], [-1, 0], [-1, -1], [0, -1], [1, -1]]
-
-    def is_valid(self, x, y):
-        return 0 <= x < self.n and 0 <= y < self.m
-
-    def evaluate(self, matrix):
-        agent, player = 0, 0
-        for i in range(self.n):
-            for j in range(self.m):
-                if matrix[i][j] == 2:
-                    agent += 1
-
-                if matrix[i][j] == 3:
-                    player += 1
-
-        return agent, player
-
-    def getAvailablePositions(self, matrix):
-        res = []
-        for i in range(self.n):
-            for j in range(self.m):
-                if matrix[i][j] == -1:
-                    res.append((i, j))
-        return res
-
-    def dfs(self, matrix, x, y, xlast, ylast, p, path):
-        found = False
-        ind = 0
-        for i in range(len(path)):
-            if path[i][0] == x and path[i][1] == y:
-                if len(path) - i <= 3:
-                    return False, None
-                found = True
-                ind = i
-                break
-        if found:
-            return True, path[ind:]
-
-        path = deepcopy(path)
-        path.append((x, y))
-
-        for t in self.next:
-            i, j = x + t[0], y + t[1]
-            if self.is_valid(i, j) and matrix[i][j] == p and (not (i == xlast and j == ylast)):
-                res, pp = self.dfs(matrix, i, j, x, y, p, path)
-                if res:
-                    return res, pp
-        matrix[x][y] = 5
-        return False, None
-
-    def check_point(self, x, y, path):
-        a, b, c, d = False, False, False, False
-        for p in path:
-            a = a or (p[1] == y and p[0] < x)
-            b = b or (p[1] == y and p[0] > x)
-            c = c or (p[0] == x and p[1] < y)
-            d = d or (p[0] == x and p[1] > y)
-        return a and b and c and d
-
-    def cover_area(self, matrix, path, p):
-        # print(f'cycle is: {path}')
-        for i in range(self.n):
-            for j in range(self.m):
-                if self.check_point(i, j, path):
-                    matrix[i][j] = p + 2
-        for pp in path:
-            matrix[pp[0]][pp[1]] = -(p + 2)
-
-    def fix_matrix(self, matrix):
-        m = deepcopy(matrix)
-        pp = []
-        for p in range(2):
-            for i in range(self.n):
-                for j in range(self.m):
-                    if m[i][j] == p:
-                        pp = []
-                        res, path = self.dfs(m, i, j, -1, -1, p, pp)
-                        if res:
-                            self.cover_area(matrix, path, p)
-
-    def addMove(self, x, y, p):
-        print('new move added to game')
-        self.moves.add(Move(x, y, p))
-        self.matrix[x][y] = p
-        self.fix_matrix(self.matrix)
-
-    def getMoves(self):
-        return self.moves
-
-
-class Agent:
-    def __init__(self, n, m, game):
-        self.n = n
-        self.m = m
-        self.game = game
-
-    def minimax(self, matrix, t, q, isMax):
-        tt = self.game.getAvailablePositions(matrix)
-        tempT = len(t)
-        v = 1
-        while (tempT > 0):
-            if v * tempT > 200:
-                break
-            else:
-                v *= tempT
-            tempT -= 1
-
-        if (len(tt) == 0) or q > max(1, 2 * (len(t) - tempT)):
-            a, p = self.game.evaluate(matrix)
-            return a - p
-
-        best = -(self.n * self.m)
-        if not isMax:
-            best = -best
-
-        for i in range(len(tt)):
-            pos = tt[i]
-            m = deepcopy(matrix)
-            m[pos[0]][pos[1]] = 0 if isMax else 1
-            self.game.fix_matrix(m)
-            if isMax:
-                best = max(best, self.minimax(m, t, q + 1, False))
-            else:
-                best = min(best, self.minimax(m, t, q + 1, True))
-        return best
-
-    def findBestMove(self, matrix):
-        t = self.game.getAvailablePositions(matrix)
-        print(f't = {t}')
-        if len(t) == 0:
-            return None
-        p1, p2 = self.game.evaluate(matrix)
-        best = - self.n * self.m
-        bestMove = None
-        for pos in t:
-            m = deepcopy(matrix)
-            m[pos[0]][pos[1]] = 0
-            self.game.fix_matrix(m)
-            res = self.minimax(m, t, 1, False)
-            # print(f'res = {res}')
-            if res > best:
-                best = res
-                bestMove = pos
-            if res == best:
-                if random.randint(1, 5) == 1:
-                    bestMove = pos
-        print(f'best move: {bestMove}')
-        return bestMove
-
-    def make_a_move(self, game_matrix):
-        matrix = deepcopy(game_matrix)
-        bestMove = self.findBestMove(matrix)
-        return bestMove
-
-
 from math import sqrt
+import queue
+import threading
+from game import Game, Agent
+from book import PositionCache
 
 OFFSET = 10
 OVAL_SIZE = 5
+POLL_MS = 50
 n, m = None, None
 canvas = None
 graph = None
 game = None
 agent = None
+cache = None
+# incremented on every new game, results of the agent for an older game are dropped
+generation = 0
+thinking = False
 
 
 def dist(x0, y0, x1, y1):
@@ -232,34 +56,74 @@ def draw_calculating():
                        text="Calculating...", tag='calculating')
 
 
-def draw_dot(event):
+def draw_move(x0, y0, p):
     w, h, offset, int1, int2 = get_canvas_info()
+    s = OVAL_SIZE
+    x, y = offset + x0 * int1, offset + y0 * int2
+    canvas.create_oval(x - s, y - s, x + s, y + s, fill=get_color(p), tag='player_dots')
+
+
+def draw_dot(event):
     print(f'({event.x}, {event.y})')
+    if thinking:
+        return
     res, x0, y0 = check_in_the_area(event.x, event.y)
-    if not res:
+    if not res or game.matrix[x0][y0] != -1:
         return
 
     print(f'added')
-    s = OVAL_SIZE
-    x, y = offset + x0 * int1, offset + y0 * int2
-    canvas.create_oval(x - s, y - s, x + s, y + s, fill=get_color(1), tag='player_dots')
-
+    game.addMove(x0, y0, 1)
+    draw_move(x0, y0, 1)
     draw_calculating()
     status['text'] = 'Calculating...'
-    create_grid()
-    root.update_idletasks()
-    game.addMove(x0, y0, 1)
+    start_agent()
+
+
+def start_agent():
+    '''
+        Runs the agent in a worker thread. The result is picked up from the Tk event loop by poll_agent.
+    '''
+    global thinking
+    thinking = True
+    results = queue.Queue()
+    current, matrix = agent, game.matrix
+
+    def run():
+        # an exception is posted too, otherwise poll_agent would wait for a move forever
+        try:
+            results.put(current.make_a_move(matrix))
+        except Exception as e:
+            results.put(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    root.after(POLL_MS, poll_agent, generation, results)
+
+
+def poll_agent(gen, results):
+    global thinking
+    if gen != generation:
+        return
+    try:
+        m = results.get_nowait()
+    except queue.Empty:
+        root.after(POLL_MS, poll_agent, gen, results)
+        return
 
-    m = agent.make_a_move(game.matrix)
+    thinking = False
+    canvas.delete('calculating')
+    if isinstance(m, Exception):
+        print(f'Agent failed: {type(m).__name__}: {m}')
+        status['text'] = 'Agent failed, your move'
+        return
     if m is not None:
         game.addMove(m[0], m[1], 0)
+        draw_move(m[0], m[1], 0)
     else:
         print("Game is finished")
     score1, score2 = game.evaluate(game.matrix)
     print(f'Game score: {score1} - {score2}')
     score['text'] = f'Agent {score1} - {score2} Player'
     status['text'] = 'Your move'
-    create_grid()
 
 
 def create_grid(event=None):
@@ -277,12 +141,12 @@ def create_grid(event=None):
         y = offset + i * int2
         canvas.create_line([(0, y), (w, y)], tag='grid_line')
 
-    s = OVAL_SIZE
     moves = game.getMoves()
     print(f'moves size: {len(moves.getMoves())}')
     for move in moves.getMoves():
-        x, y = offset + move.x * int1, offset + move.y * int2
-        canvas.create_oval(x - s, y - s, x + s, y + s, fill=get_color(move.p), tag='player_dots')
+        draw_move(move.x, move.y, move.p)
+    if thinking:
+        draw_calculating()
 
 
 def create_new_game():
@@ -290,6 +154,8 @@ def create_new_game():
     global agent
     global n
     global m
+    global generation
+    global thinking
     nStr = nEntry.get()
     mStr = mEntry.get()
     print(f'n = {nStr}, m = {mStr}')
@@ -300,10 +166,14 @@ def create_new_game():
             return
         n = newN
         m = newM
+        agent.stop()
+        generation += 1
+        thinking = False
         game = Game(n + 1, m + 1)
-        agent = Agent(n + 1, m + 1)
+        agent = Agent(n + 1, m + 1, game, cache=cache)
     except:
         return
+    score['text'] = 'Agent 0 - 0 Player'
     status['text'] = "Resize window please"
     create_grid()
     root.geometry("=600x600")
@@ -315,7 +185,8 @@ if __name__ == '__main__':
     # n, m = map(int, input().split())
     n, m = 3, 3
     game = Game(n + 1, m + 1)
-    agent = Agent(n + 1, m + 1, game)
+    cache = PositionCache()
+    agent = Agent(n + 1, m + 1, game, cache=cache)
     root = Tk()
     root.geometry("=600x600")
     info_panel = Frame(master=root, bg='white')
@@ -0,0 +1,121 @@
+import math
+import random
+import time
+
+from board import popcount, CAPTURED, WALLS
+
+
+class Node:
+    __slots__ = ('move', 'parent', 'board', 'player', 'children', 'untried', 'visits', 'wins')
+
+    def __init__(self, move, parent, board, player, untried):
+        self.move = move
+        self.parent = parent
+        self.board = board
+        # player who made the move leading to this node, wins are counted for this player
+        self.player = player
+        self.children = []
+        self.untried = untried
+        self.visits = 0
+        self.wins = 0.0
+
+
+class MCTS:
+    '''
+        Monte Carlo tree search with UCT selection. Every expanded node is scored by a batch of playouts.
+        A playout does not replay the game move by move: the free cells are filled at random, alternating
+        between the players, and the territory each player encloses is counted with one flood fill per player.
+        The search stops after time_limit seconds or iterations expansions, whichever comes first.
+        Only cells within radius of the dots on the board are expanded (see AlphaBeta).
+    '''
+
+    def __init__(self, time_limit=1.0, iterations=None, batch=16, c=1.4, radius=2, seed=None):
+        self.time_limit = time_limit
+        self.iterations = iterations
+        self.batch = batch
+        self.c = c
+        self.radius = radius
+        self.rng = random.Random(seed)
+        self.stopped = False
+        self.nodes = 0
+        self.depth = 0
+
+    def candidates(self, board):
+        free = board.free()
+        stones = board.occupied() & ~free
+        if self.radius is None or not stones:
+            cells = board.free_cells()
+        else:
+            cells = list(board.cells(board.near(stones, self.radius) & free))
+        self.rng.shuffle(cells)
+        return cells
+
+    def playout(self, board, p):
+        '''
+            Result of one random playout for player 0: 1 for a win, 0.5 for a draw, 0 for a loss.
+            p is the player to move.
+        '''
+        free = list(board.indices(board.free()))
+        self.rng.shuffle(free)
+        walls = [board.masks[q] | board.masks[WALLS + q] for q in range(2)]
+        for i, cell in enumerate(free):
+            walls[p ^ (i & 1)] |= 1 << cell
+        inside = [board.enclosed(walls[q]) for q in range(2)]
+        a = popcount(board.masks[CAPTURED]) + popcount(inside[0] & ~inside[1])
+        b = popcount(board.masks[CAPTURED + 1]) + popcount(inside[1] & ~inside[0])
+        return 1.0 if a > b else 0.5 if a == b else 0.0
+
+    def select(self, node):
+        log_n = math.log(node.visits)
+        return max(node.children,
+                   key=lambda ch: ch.wins / ch.visits + self.c * math.sqrt(log_n / ch.visits))
+
+    def stop(self):
+        '''
+            Makes a running search return as soon as possible, can be called from another thread.
+            The next search starts again.
+        '''
+        self.stopped = True
+
+    def search(self, board, p=0):
+        root = Node(None, None, board, 1 - p, self.candidates(board))
+        self.stopped = False
+        self.nodes = 0
+        self.depth = 0
+        if len(root.untried) == 0:
+            return None, 0.0
+
+        deadline = None if self.time_limit is None else time.perf_counter() + self.time_limit
+        iteration = 0
+        while self.iterations is None or iteration < self.iterations:
+            if iteration > 0 and (self.stopped or deadline is not None and time.perf_counter() > deadline):
+                break
+            iteration += 1
+
+            node, depth = root, 0
+            while len(node.untried) == 0 and len(node.children) > 0:
+                node = self.select(node)
+                depth += 1
+
+            if len(node.untried) > 0:
+                x, y = node.untried.pop()
+                child_board = node.board.copy()
+                child_board.play(x, y, 1 - node.player)
+                child = Node((x, y), node, child_board, 1 - node.player, self.candidates(child_board))
+                node.children.append(child)
+                node = child
+                depth += 1
+            self.depth = max(self.depth, depth)
+
+            result = 0.0
+            for _ in range(self.batch):
+                result += self.playout(node.board, 1 - node.player)
+            self.nodes += self.batch
+
+            while node is not None:
+                node.visits += self.batch
+                node.wins += result if node.player == 0 else self.batch - result
+                node = node.parent
+
+        best = max(root.children, key=lambda ch: ch.visits)
+        return best.move, best.wins / best.visits
@@ -0,0 +1,276 @@
+import multiprocessing
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from board import popcount
+
+INF = 10 ** 9
+EXACT, LOWER, UPPER = 0, 1, 2
+# xor-ed into the board hash when the second player is to move
+SIDE = random.Random('side').getrandbits(64)
+
+
+class Timeout(Exception):
+    pass
+
+
+class TranspositionTable:
+    '''
+        Fixed size table indexed by the Zobrist hash of the position. An entry is replaced if the new one
+        was searched at least as deep or the old one is left from a previous search.
+    '''
+
+    def __init__(self, size=1 << 18):
+        self.size = size
+        self.table = [None] * size
+        self.generation = 0
+
+    def get(self, key):
+        e = self.table[key % self.size]
+        if e is not None and e[0] == key:
+            return e
+        return None
+
+    def put(self, key, depth, flag, value, move):
+        i = key % self.size
+        e = self.table[i]
+        if e is None or e[5] != self.generation or depth >= e[1]:
+            self.table[i] = (key, depth, flag, value, move, self.generation)
+
+
+_engine = None
+
+
+def _init_worker(tt_size, radius, cancel):
+    global _engine
+    _engine = AlphaBeta(time_limit=None, tt_size=tt_size, radius=radius)
+    _engine.cancel = cancel
+
+
+def _search_chunk(board, p, depth, moves, time_left, generation):
+    '''
+        Runs in a pool process: exact values of the root moves in the chunk which tie for the chunk's best.
+        Returns None if the time budget ran out or the search was stopped.
+        generation is the one of the parent's table, so entries of earlier moves can be replaced.
+    '''
+    _engine.nodes = 0
+    _engine.tt.generation = generation
+    _engine.deadline = None if time_left is None else time.perf_counter() + time_left
+    try:
+        best, ties = _engine.root(board, p, depth, moves)
+    except Timeout:
+        return None, _engine.nodes
+    finally:
+        _engine.deadline = None
+    return (best, ties), _engine.nodes
+
+
+class AlphaBeta:
+    '''
+        Negamax alpha-beta search with iterative deepening under a time budget.
+        Moves are ordered: transposition table move, killer moves, then moves which may close a cycle,
+        block a cycle of the opponent or touch existing chains. Only cells within radius of the dots
+        already on the board are considered (all free cells if radius is None or the board is empty).
+        Player p plays dots with value p, the score is the number of captured cells of p minus the opponent's.
+        With workers > 1 every iteration spreads the root moves over a process pool. Root values are exact
+        for all tied moves in both modes, so with a fixed seed and max_depth (and no time limit) the serial
+        and the parallel search return the same move.
+    '''
+
+    def __init__(self, time_limit=1.0, max_depth=None, tt_size=1 << 18, radius=2, seed=None, workers=1):
+        self.time_limit = time_limit
+        self.max_depth = max_depth
+        self.tt_size = tt_size
+        self.radius = radius
+        self.workers = workers
+        self.pool = None
+        self.rng = random.Random(seed)
+        self.tt = TranspositionTable(tt_size)
+        self.killers = []
+        self.deadline = None
+        self.stopped = False
+        # multiprocessing.Event shared with the pool workers, stop() sets it to stop them too
+        self.cancel = None
+        self.nodes = 0
+        self.depth = 0
+
+    def evaluate(self, board, p):
+        a, b = board.score()
+        return a - b if p == 0 else b - a
+
+    def candidates(self, board):
+        free = board.free()
+        stones = board.occupied() & ~free
+        if self.radius is None or not stones:
+            return free
+        return board.near(stones, self.radius) & free
+
+    def moves(self, board, p, tt_move=None, ply=0):
+        own, opp = board.dots(p), board.dots(1 - p)
+        keyed = []
+        for i in board.indices(self.candidates(board)):
+            around = board.spread(1 << i)
+            a, b = popcount(around & own), popcount(around & opp)
+            priority = a + b
+            if a >= 2:
+                priority += 4 * a
+            if b >= 2:
+                priority += 2 * b
+            keyed.append((-priority, i))
+        keyed.sort()
+        res = [divmod(i, board.stride) for _, i in keyed]
+        first = [tt_move] if tt_move is not None else []
+        if ply < len(self.killers):
+            first += [k for k in self.killers[ply] if k is not None]
+        for move in reversed(first):
+            if move in res:
+                res.remove(move)
+                res.insert(0, move)
+        return res
+
+    def _killer(self, ply, move):
+        while len(self.killers) <= ply:
+            self.killers.append([None, None])
+        if self.killers[ply][0] != move:
+            self.killers[ply] = [move, self.killers[ply][0]]
+
+    def negamax(self, board, depth, alpha, beta, p, ply):
+        self.nodes += 1
+        if self.nodes & 1023 == 0 and (self.stopped or self.cancel is not None and self.cancel.is_set() or
+                                       self.deadline is not None and time.perf_counter() > self.deadline):
+            raise Timeout()
+        if depth == 0 or not board.free():
+            return self.evaluate(board, p)
+
+        key = board.hash ^ (SIDE if p else 0)
+        entry = self.tt.get(key)
+        tt_move = None
+        if entry is not None:
+            tt_move = entry[4]
+            # deeper entries are used only for ordering, so values do not depend on what the table holds
+            if entry[1] == depth:
+                flag, value = entry[2], entry[3]
+                if flag == EXACT or (flag == LOWER and value >= beta) or (flag == UPPER and value <= alpha):
+                    return value
+
+        alpha0 = alpha
+        best, best_move = -INF, None
+        for move in self.moves(board, p, tt_move, ply):
+            board.make_move(move[0], move[1], p)
+            v = -self.negamax(board, depth - 1, -beta, -alpha, 1 - p, ply + 1)
+            board.unmake_move()
+            if v > best:
+                best, best_move = v, move
+            if v > alpha:
+                alpha = v
+            if alpha >= beta:
+                self._killer(ply, move)
+                break
+
+        if best_move is None:
+            return self.evaluate(board, p)
+        flag = UPPER if best <= alpha0 else LOWER if best >= beta else EXACT
+        self.tt.put(key, depth, flag, best, best_move)
+        return best
+
+    def root(self, board, p, depth, moves):
+        '''
+            Exact values of every root move that ties for the best one. Moves are searched with the window
+            opened one point below the current best, so ties are detected exactly.
+            The search makes and unmakes moves on board in place; after a Timeout board is left mid-search.
+        '''
+        best, ties = -INF, []
+        for move in moves:
+            alpha = best - 1 if best > -INF else -INF
+            board.make_move(move[0], move[1], p)
+            v = -self.negamax(board, depth - 1, -INF, -alpha, 1 - p, 1)
+            board.unmake_move()
+            if v > best:
+                best, ties = v, [move]
+            elif v == best:
+                ties.append(move)
+        return best, ties
+
+    def root_parallel(self, board, p, depth, moves):
+        if self.pool is None:
+            self.cancel = multiprocessing.Event()
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                            initargs=(self.tt_size, self.radius, self.cancel))
+            if self.stopped:
+                self.cancel.set()
+        time_left = None
+        if self.deadline is not None:
+            time_left = self.deadline - time.perf_counter()
+            if time_left <= 0:
+                raise Timeout()
+        # interleave the ordered moves, so that every chunk gets some of the promising ones
+        k = min(len(moves), self.workers * 4)
+        chunks = [moves[i::k] for i in range(k)]
+        futures = [self.pool.submit(_search_chunk, board, p, depth, chunk, time_left, self.tt.generation)
+                   for chunk in chunks]
+        best, ties, timeout = -INF, [], False
+        for future in futures:
+            res, nodes = future.result()
+            self.nodes += nodes
+            if res is None:
+                timeout = True
+                continue
+            if res[0] > best:
+                best, ties = res
+            elif res[0] == best:
+                ties += res[1]
+        if timeout:
+            raise Timeout()
+        order = {move: i for i, move in enumerate(moves)}
+        ties.sort(key=order.get)
+        return best, ties
+
+    def stop(self):
+        '''
+            Makes a running search return as soon as possible, can be called from another thread.
+            The next search starts again.
+        '''
+        self.stopped = True
+        if self.cancel is not None:
+            self.cancel.set()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+            self.cancel = None
+
+    def search(self, board, p=0):
+        # the search works on its own board, which a timeout may leave in the middle of a line
+        board = board.copy()
+        self.stopped = False
+        if self.cancel is not None:
+            self.cancel.clear()
+        self.nodes = 0
+        self.depth = 0
+        self.killers = []
+        self.tt.generation += 1
+        moves = self.moves(board, p)
+        if len(moves) == 0:
+            return None, self.evaluate(board, p)
+
+        max_depth = popcount(board.free())
+        if self.max_depth is not None:
+            max_depth = min(max_depth, self.max_depth)
+        start = time.perf_counter()
+        best, ties = None, moves[:1]
+        for depth in range(1, max_depth + 1):
+            # the first iteration always finishes, so there is a move to return
+            self.deadline = None if depth == 1 or self.time_limit is None else start + self.time_limit
+            try:
+                if self.workers > 1:
+                    best, ties = self.root_parallel(board, p, depth, moves)
+                else:
+                    best, ties = self.root(board, p, depth, moves)
+            except Timeout:
+                break
+            self.depth = depth
+            moves = ties + [move for move in moves if move not in ties]
+        self.deadline = None
+        return self.rng.choice(sorted(ties)), best
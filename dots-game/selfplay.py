@@ -0,0 +1,141 @@
+import argparse
+import contextlib
+import json
+import os
+import time
+from game import Game, Agent, MCTSAgent, RandomAgent
+
+AGENTS = {
+    'alphabeta': Agent,
+    'mcts': MCTSAgent,
+    'random': RandomAgent,
+}
+
+
+def percentile(values, q):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * q / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def make_agent(kind, n, m, game, player, args, seed):
+    if kind == 'alphabeta':
+        return Agent(n, m, game, time_limit=args.time_limit, max_depth=args.max_depth, seed=seed,
+                     workers=args.workers, player=player)
+    if kind == 'mcts':
+        return MCTSAgent(n, m, game, time_limit=args.time_limit, iterations=args.iterations, seed=seed,
+                         player=player)
+    return RandomAgent(n, m, game, seed=seed, player=player)
+
+
+def play_game(n, m, kinds, args, seed):
+    '''
+        Plays one game on an n x m points board. kinds[p] is the agent of player p, player 0 moves first.
+    '''
+    game = Game(n, m)
+    agents = [make_agent(kinds[p], n, m, game, p, args, seed + p) for p in range(2)]
+    stats = [{'latency': [], 'nodes': 0, 'time': 0.0} for _ in range(2)]
+    capture = []
+    p = 0
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        while True:
+            start = time.perf_counter()
+            move = agents[p].make_a_move(game.matrix)
+            elapsed = time.perf_counter() - start
+            if move is None:
+                break
+            stats[p]['latency'].append(elapsed)
+            stats[p]['time'] += elapsed
+            if hasattr(agents[p], 'search'):
+                stats[p]['nodes'] += agents[p].search.nodes
+
+            start = time.perf_counter()
+            game.addMove(move[0], move[1], p)
+            capture.append(time.perf_counter() - start)
+            p = 1 - p
+    for agent in agents:
+        if hasattr(agent, 'search') and hasattr(agent.search, 'close'):
+            agent.search.close()
+
+    score = game.evaluate(game.matrix)
+    return {
+        'size': [n, m],
+        'agents': kinds,
+        'seed': seed,
+        'score': list(score),
+        'moves': len(game.getMoves().getMoves()),
+        'stats': stats,
+        'capture': capture,
+    }
+
+
+def summarize(games):
+    res = {}
+    for g in games:
+        for p in range(2):
+            s = res.setdefault(g['agents'][p], {'games': 0, 'wins': 0, 'draws': 0, 'latency': [],
+                                                'nodes': 0, 'time': 0.0})
+            s['games'] += 1
+            own, other = g['score'][p], g['score'][1 - p]
+            s['wins'] += own > other
+            s['draws'] += own == other
+            s['latency'] += g['stats'][p]['latency']
+            s['nodes'] += g['stats'][p]['nodes']
+            s['time'] += g['stats'][p]['time']
+
+    for s in res.values():
+        latency = s.pop('latency')
+        s['moves'] = len(latency)
+        s['latency'] = {f'p{q}': percentile(latency, q) for q in (50, 90, 99)}
+        s['latency']['max'] = max(latency) if latency else None
+        s['nodes_per_second'] = s['nodes'] / s['time'] if s['time'] > 0 else None
+
+    capture = [t for g in games for t in g['capture']]
+    res['capture'] = {f'p{q}': percentile(capture, q) for q in (50, 90, 99)}
+    res['capture']['moves'] = len(capture)
+    return res
+
+
+def parse_size(s):
+    n, m = s.lower().split('x')
+    return int(n), int(m)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless self-play and benchmark of the dots-game agents')
+    parser.add_argument('--games', type=int, default=10, help='games per board size')
+    parser.add_argument('--size', type=parse_size, action='append',
+                        help='board size in points, e.g. 4x4 (can be repeated)')
+    parser.add_argument('--agents', nargs=2, choices=sorted(AGENTS), default=['alphabeta', 'random'],
+                        help='agents of the first and the second player')
+    parser.add_argument('--time-limit', type=float, default=0.5, help='seconds per move')
+    parser.add_argument('--max-depth', type=int, default=None)
+    parser.add_argument('--iterations', type=int, default=None, help='MCTS iterations per move')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--swap', action='store_true', help='alternate which agent moves first')
+    parser.add_argument('--output', default='selfplay.json')
+    args = parser.parse_args()
+
+    games = []
+    for n, m in args.size or [(4, 4)]:
+        for i in range(args.games):
+            kinds = list(args.agents)
+            if args.swap and i % 2 == 1:
+                kinds.reverse()
+            g = play_game(n, m, kinds, args, args.seed + 2 * i)
+            print(f'{n}x{m} game {i + 1}/{args.games}: {kinds[0]} {g["score"][0]} - {g["score"][1]} {kinds[1]}')
+            games.append(g)
+
+    report = {'config': vars(args), 'summary': summarize(games), 'games': games}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report['summary'], indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+import argparse
+import time
+import numpy as np
+from lexical import load_bm25
+from main import DATASET_PATH, Transformer, load_dataset, load_embeddings, load_index
+
+
+def rrf(rankings, k=60):
+    '''
+        Reciprocal rank fusion: every ranking adds 1 / (k + rank) to the score of its facts, rank starting at 1.
+    '''
+    res = {}
+    for ranking in rankings:
+        for rank, fact in enumerate(ranking.tolist(), 1):
+            res[fact] = res.get(fact, 0.0) + 1 / (k + rank)
+    return res
+
+
+def weighted(results, weights):
+    '''
+        Weighted sum of the scores of every (facts, scores) result, each scaled to [0, 1] first.
+        A fact missing from a result gets 0 from it.
+    '''
+    res = {}
+    for (facts, scores), w in zip(results, weights):
+        if len(scores) == 0:
+            continue
+        lo, hi = scores.min(), scores.max()
+        scaled = (scores - lo) / (hi - lo) if hi > lo else np.ones(len(scores))
+        for fact, s in zip(facts.tolist(), scaled.tolist()):
+            res[fact] = res.get(fact, 0.0) + w * s
+    return res
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+class HybridRetriever:
+    '''
+        Takes candidates from the BM25 index and from the dense index and fuses them with reciprocal rank fusion
+        (fusion='rrf') or a weighted sum of the scaled scores (fusion='weighted', weight is the share of the
+        dense score). Without a dense index, the dense scores are only computed for the BM25 candidates,
+        from the stored embeddings: the lexical index prefilters the facts.
+        With rerank the exact cosine similarity of every fused candidate to the query is computed from the stored
+        embeddings and blended with the fused score (both scaled to [0, 1], rerank_weight is the share of the
+        cosine), so the lexical evidence is kept: it is the same embedding as the dense retrieval, not a
+        cross-encoder.
+        search has the interface of DenseSearcher in server.py: a batch of queries in, (scores, ids) out,
+        the scores are the fused ones (or the blended ones with rerank), higher is better.
+    '''
+
+    def __init__(self, model, bm25, index=None, embeddings=None, fusion='rrf', candidates=100, weight=0.5,
+                 rrf_k=60, rerank=False, rerank_weight=0.5):
+        if (index is None or rerank) and embeddings is None:
+            raise ValueError('The embeddings are needed to prefilter or rerank the candidates')
+        self.model = model
+        self.bm25 = bm25
+        self.index = index
+        self.embeddings = embeddings
+        self.fusion = fusion
+        self.candidates = candidates
+        self.weight = weight
+        self.rrf_k = rrf_k
+        self.rerank = rerank
+        self.rerank_weight = rerank_weight
+
+    def cosine(self, vector, facts):
+        '''
+            (facts, cosine similarity of their embeddings to the query vector), the facts sorted to read
+            the embeddings in file order.
+        '''
+        facts = np.sort(facts)
+        return facts, normalize(self.embeddings[facts]) @ vector
+
+    def fuse(self, lexical, dense):
+        if self.fusion == 'rrf':
+            # the rankings are the facts sorted by their scores
+            scores = rrf([facts[np.argsort(-s, kind='stable')] for facts, s in (lexical, dense)], self.rrf_k)
+        else:
+            scores = weighted([lexical, dense], [1 - self.weight, self.weight])
+        facts = np.array(list(scores), np.int64)
+        return facts, np.array(list(scores.values()), np.float32)
+
+    def search(self, queries, k=10):
+        vectors = normalize(self.model.embed_batch(queries))
+        if self.index is not None:
+            distances, labels = self.index.search(vectors, self.candidates)
+        res_scores = np.full((len(queries), k), -np.inf, np.float32)
+        res_ids = np.full((len(queries), k), -1, np.int64)
+        for i, query in enumerate(queries):
+            lexical = self.bm25.search(query, self.candidates)
+            if self.index is not None:
+                found = labels[i] >= 0
+                # squared L2 distance of unit vectors: 2 - 2 cos
+                dense = labels[i][found], 1 - distances[i][found] / 2
+            else:
+                dense = self.cosine(vectors[i], lexical[0])
+            facts, scores = self.fuse(lexical, dense)
+            if self.rerank and len(facts) > 0:
+                blended = weighted([(facts, scores), self.cosine(vectors[i], facts)],
+                                   [1 - self.rerank_weight, self.rerank_weight])
+                facts = np.array(list(blended), np.int64)
+                scores = np.array(list(blended.values()), np.float32)
+            order = np.argsort(-scores, kind='stable')[:k]
+            res_scores[i, :len(order)] = scores[order]
+            res_ids[i, :len(order)] = facts[order]
+        return res_scores, res_ids
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Hybrid BM25 and dense search over the facts')
+    parser.add_argument('queries', nargs='*',
+                        default=['Linus Torvalds', 'Harry Potter', 'CPU', 'Computer Science', 'Tom Cruise', 'Football'])
+    parser.add_argument('--fusion', choices=['rrf', 'weighted'], default='rrf')
+    parser.add_argument('--weight', type=float, default=0.5, help='share of the dense score in weighted fusion')
+    parser.add_argument('--candidates', type=int, default=100, help='candidates taken from each retriever')
+    parser.add_argument('--prefilter', action='store_true',
+                        help='score only the BM25 candidates with the embeddings instead of searching the dense index')
+    parser.add_argument('--rerank', action='store_true',
+                        help='blend the fused scores with the exact cosine similarity of the candidates')
+    parser.add_argument('--rerank-weight', type=float, default=0.5, help='share of the cosine similarity in --rerank')
+    parser.add_argument('-k', type=int, default=10)
+    args = parser.parse_args()
+
+    dataset = load_dataset(DATASET_PATH)
+    model = Transformer()
+    embeddings = load_embeddings(dataset, model)
+    index = None if args.prefilter else load_index(dataset, embeddings)
+    retriever = HybridRetriever(model, load_bm25(dataset), index, embeddings, args.fusion, args.candidates,
+                                args.weight, rerank=args.rerank, rerank_weight=args.rerank_weight)
+
+    for query in args.queries:
+        start = time.perf_counter()
+        scores, ids = retriever.search([query], args.k)
+        elapsed = time.perf_counter() - start
+        print(f'Answers for the query: "{query}" ({elapsed * 1000:.1f} ms):')
+        for ind, score in zip(ids[0], scores[0]):
+            if ind >= 0:
+                print(f'\t{dataset[ind]} - id: {ind}, score: {score:.4f}')
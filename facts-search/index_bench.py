@@ -0,0 +1,92 @@
+import argparse
+import json
+import time
+import numpy as np
+import faiss
+from indexing import INDEX_TYPES, build_index, index_factory_string, set_search_params
+from store import MODEL_NAME, EmbeddingStore
+
+
+def synthetic(n, dim, clusters=1000, seed=0):
+    '''
+        Clustered random vectors, to try the indexes without the embeddings.
+    '''
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    return centers[rng.integers(clusters, size=n)] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def recall(found, truth):
+    '''
+        Average fraction of the true k nearest neighbours among the k found ones.
+    '''
+    return np.mean([len(np.intersect1d(f, t)) / len(t) for f, t in zip(found, truth)])
+
+
+def sweeps(kind, nprobes, ef_searches):
+    if kind.startswith('ivf') or '-ivf' in kind:
+        return [{'nprobe': v} for v in nprobes]
+    if kind == 'hnsw':
+        return [{'ef_search': v} for v in ef_searches]
+    return [{}]
+
+
+def bench(data, queries, truth, kind, k=10, nlist=2048, m=64, train_size=100000, nprobes=(1,), ef_searches=(16,)):
+    factory = index_factory_string(kind, nlist, m)
+    start = time.perf_counter()
+    index = build_index(data, data.shape[1], factory, train_size)
+    build = time.perf_counter() - start
+    size = len(faiss.serialize_index(index))
+    res = []
+    for params in sweeps(kind, nprobes, ef_searches):
+        set_search_params(index, **params)
+        start = time.perf_counter()
+        _, ids = index.search(queries, k)
+        seconds = time.perf_counter() - start
+        res.append(dict(params, type=kind, factory=factory, build_s=build, size_mb=size / 2 ** 20,
+                        qps=len(queries) / seconds, recall=float(recall(ids, truth))))
+    return res
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build time, size, QPS and recall@k of the faiss index types, '
+                                                 'against exact search on the same embeddings')
+    parser.add_argument('--types', nargs='+', choices=sorted(INDEX_TYPES), default=sorted(INDEX_TYPES))
+    parser.add_argument('--queries', type=int, default=1000, help='number of embeddings used as queries')
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--nlist', type=int, default=2048)
+    parser.add_argument('--m', type=int, default=64, help='PQ sub-vectors, has to divide the dimension')
+    parser.add_argument('--train-size', type=int, default=100000)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 8, 32, 128])
+    parser.add_argument('--ef-search', type=int, nargs='+', default=[16, 64, 256])
+    parser.add_argument('--synthetic', type=int, default=None, help='use that many random vectors instead')
+    parser.add_argument('--output', default=None, help='json file for the results')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        data = synthetic(args.synthetic, 768)
+    else:
+        data = EmbeddingStore(model=MODEL_NAME).vectors
+        if len(data) == 0:
+            raise SystemExit('No embeddings, run main.py first or use --synthetic')
+    rng = np.random.default_rng(1)
+    queries = np.ascontiguousarray(data[np.sort(rng.choice(len(data), args.queries, replace=False))], np.float32)
+
+    exact = build_index(data, data.shape[1], index_factory_string('flat'))
+    start = time.perf_counter()
+    _, truth = exact.search(queries, args.k)
+    print(f'exact search: {len(queries) / (time.perf_counter() - start):.1f} qps')
+    del exact
+
+    results = []
+    for kind in args.types:
+        for r in bench(data, queries, truth, kind, args.k, args.nlist, args.m, args.train_size,
+                       args.nprobe, args.ef_search):
+            results.append(r)
+            params = ' '.join(f'{name}={r[name]}' for name in ('nprobe', 'ef_search') if name in r)
+            print(f'{kind:14} {params:14} build {r["build_s"]:7.1f} s  {r["size_mb"]:8.1f} MB  '
+                  f'{r["qps"]:9.1f} qps  recall@{args.k} {r["recall"]:.3f}')
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
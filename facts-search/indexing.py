@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import numpy as np
+import faiss
+from store import fact_keys
+
+INDEX_PATH = 'index'
+
+# faiss index_factory strings, nlist is the number of IVF cells and m the number of PQ sub-vectors
+INDEX_TYPES = {
+    'flat': 'Flat',
+    'hnsw': 'HNSW32',
+    'sq8': 'SQ8',
+    'ivf-flat': 'IVF{nlist},Flat',
+    'ivf-hnsw-flat': 'IVF{nlist}_HNSW32,Flat',
+    'ivf-sq8': 'IVF{nlist},SQ8',
+    'ivf-pq': 'IVF{nlist},PQ{m}',
+    'opq-ivf-pq': 'OPQ{m},IVF{nlist},PQ{m}',
+}
+INDEX_TYPE = 'ivf-hnsw-flat'
+
+
+def index_factory_string(kind=INDEX_TYPE, nlist=2048, m=64):
+    '''
+        The vectors are normalized first, so the L2 distance ranks the facts like the cosine similarity.
+    '''
+    return 'L2norm,' + INDEX_TYPES[kind].format(nlist=nlist, m=m)
+
+
+def build_index(data, dimensions=768, factory=None, train_size=100000, path=None, seed=0, chunk=65536, ids=None):
+    '''
+        Builds the index described by the faiss factory string (index_factory_string() by default).
+        Indexes which need training are trained on a random sample of train_size vectors instead of all of them.
+        Vectors are added in chunks, faiss takes float32 only and a float32 memmap is passed through without a copy.
+        With ids the index is wrapped in an IndexIDMap2 and the vectors are added with these ids.
+    '''
+    index = faiss.index_factory(dimensions, factory or index_factory_string())
+    if not index.is_trained:
+        sample = np.arange(len(data))
+        if len(data) > train_size:
+            sample = np.sort(np.random.default_rng(seed).choice(len(data), train_size, replace=False))
+        index.train(np.ascontiguousarray(data[sample], dtype=np.float32))
+    if ids is not None:
+        index = faiss.IndexIDMap2(index)
+    for i in range(0, len(data), chunk):
+        vectors = np.ascontiguousarray(data[i:i + chunk], dtype=np.float32)
+        if ids is None:
+            index.add(vectors)
+        else:
+            index.add_with_ids(vectors, np.ascontiguousarray(ids[i:i + chunk], dtype=np.int64))
+    if path is not None:
+        faiss.write_index(index, path)
+    return index
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    '''
+        Search time parameters: nprobe, the number of IVF cells visited, and efSearch, the size of the HNSW
+        candidate list (of the index itself, or of the IVF quantizer). Parameters the index doesn't have are skipped.
+    '''
+    params = faiss.ParameterSpace()
+    for name, value in (('nprobe', nprobe), ('efSearch', ef_search), ('quantizer_efSearch', ef_search)):
+        if value is None:
+            continue
+        try:
+            params.set_index_parameter(index, name, value)
+        except RuntimeError:
+            pass
+
+
+def fact_ids(dataset):
+    '''
+        Stable ids of the facts in the index: their content hash (see store.fact_key), as a non-negative int64.
+    '''
+    return (fact_keys(dataset) & np.uint64((1 << 63) - 1)).astype(np.int64)
+
+
+def dataset_version(ids):
+    return hashlib.blake2b(np.sort(ids).tobytes(), digest_size=8).hexdigest()
+
+
+class IncrementalIndex:
+    '''
+        faiss index of the facts, kept in step with the dataset without rebuilding it. Vectors are added with
+        the ids of fact_ids in an IndexIDMap2, so an id stays the same whatever the position of the fact.
+        sync adds the vectors of new facts and marks the ids of removed ones as tombstones: they stay in the
+        index but are filtered out of the results, until tombstones make up compact_ratio of the index and it
+        is rebuilt from the live facts only.
+        The directory holds the faiss index, the live ids, the tombstones and manifest.json with the model, the
+        dimension, the factory string, the version of the dataset the index was synced with and the generation
+        which names the data files. An index of another model, dimension or factory is refused instead of
+        being silently rebuilt.
+    '''
+
+    def __init__(self, model, dim=768, factory=None, path=INDEX_PATH, compact_ratio=0.2):
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self.meta = {'model': model, 'dim': dim, 'factory': factory or index_factory_string(), 'version': None}
+        self.index = None
+        self.ids = np.zeros(0, np.int64)
+        self.tombstones = np.zeros(0, np.int64)
+        self.rows = {}
+        manifest = self._file('manifest.json')
+        if not os.path.exists(manifest):
+            return
+        with open(manifest) as f:
+            meta = json.load(f)
+        for name in ('model', 'dim', 'factory'):
+            if meta[name] != self.meta[name]:
+                raise ValueError(f'The index in {path} was built with {name} {meta[name]!r}, not {self.meta[name]!r}. '
+                                 f'Remove it or use the same settings.')
+        self.meta = meta
+        files = self._files(meta.get('generation'))
+        self.index = faiss.read_index(self._file(files['index']))
+        self.ids = np.load(self._file(files['ids']))
+        self.tombstones = np.load(self._file(files['tombstones']))
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @staticmethod
+    def _files(generation):
+        if generation is None:
+            return {'index': 'index.faiss', 'ids': 'ids.npy', 'tombstones': 'tombstones.npy'}
+        return {'index': f'index.{generation}.faiss', 'ids': f'ids.{generation}.npy',
+                'tombstones': f'tombstones.{generation}.npy'}
+
+    def save(self):
+        '''
+            Writes the data files of a new generation next to the current ones, then the manifest naming them.
+            An interrupted save leaves the old manifest pointing at the old, complete files.
+            The files of older generations are removed once the new manifest is in place.
+        '''
+        os.makedirs(self.path, exist_ok=True)
+        generation = self.meta.get('generation', 0) + 1
+        files = self._files(generation)
+        faiss.write_index(self.index, self._file(files['index']))
+        for name, array in (('ids', self.ids), ('tombstones', self.tombstones)):
+            with open(self._file(files[name]), 'wb') as f:
+                np.save(f, array)
+        meta = dict(self.meta, generation=generation, count=len(self.ids), tombstones=len(self.tombstones))
+        with open(self._file('manifest.json.tmp'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(self._file('manifest.json.tmp'), self._file('manifest.json'))
+        self.meta = meta
+        for name in os.listdir(self.path):
+            if name.startswith(('index.', 'ids.', 'tombstones.')) and name not in files.values():
+                os.remove(self._file(name))
+
+    def sync(self, dataset, embeddings):
+        '''
+            Brings the index up to date with dataset, embeddings are the vectors of its facts in the same order
+            (EmbeddingStore.vectors). Only the vectors of the facts the index doesn't have are read.
+        '''
+        ids = fact_ids(dataset)
+        self.rows = {key: row for row, key in enumerate(ids.tolist())}
+        version = dataset_version(ids)
+        if self.index is not None and version == self.meta['version']:
+            # the same facts, possibly in another order: only the rows change, nothing to write
+            return self
+        if self.index is None:
+            self.compact(ids, embeddings)
+        elif version != self.meta['version']:
+            live = set(self.ids.tolist())
+            dead = set(self.tombstones.tolist())
+            added = [key for key in self.rows if key not in live]
+            # ids are content hashes, a fact added back has the same vector as its tombstone
+            revived = [key for key in added if key in dead]
+            new = np.array([key for key in added if key not in dead], np.int64)
+            removed = live - set(self.rows)
+            if len(new) > 0:
+                rows = [self.rows[key] for key in new.tolist()]
+                self.index.add_with_ids(np.ascontiguousarray(embeddings[rows], dtype=np.float32), new)
+            self.tombstones = np.array(sorted((dead - set(revived)) | removed), np.int64)
+            self.ids = np.array(sorted(self.rows), np.int64)
+            print(f'Index: {len(new)} facts added, {len(revived)} restored, {len(removed)} removed, '
+                  f'{len(self.tombstones)} tombstones')
+            if len(self.tombstones) > self.compact_ratio * self.index.ntotal:
+                self.compact(ids, embeddings)
+        self.meta['version'] = version
+        self.save()
+        return self
+
+    def compact(self, ids, embeddings):
+        '''
+            Rebuilds the index from the live facts, dropping the tombstones.
+        '''
+        print(f'Building the index of {len(self.rows)} facts...')
+        rows = sorted(self.rows.values())
+        # without repeated facts every row is live, and the memmap is read chunk by chunk instead of copied
+        data = embeddings if len(rows) == len(embeddings) else embeddings[rows]
+        self.index = build_index(data, self.meta['dim'], self.meta['factory'], ids=ids[rows])
+        self.ids = np.array(sorted(self.rows), np.int64)
+        self.tombstones = np.zeros(0, np.int64)
+
+    def search(self, queries, k):
+        '''
+            Same as faiss Index.search, (distances, labels), but the labels are the rows of the facts in the dataset
+            of the last sync, -1 where there are less than k results. Tombstones are skipped: a query whose results
+            had tombstones among them is searched again with a larger k, until it has k live results. A query with
+            -1 padding is not: the cells it probed have no more vectors, a larger k would only return more padding.
+        '''
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        res_d = np.full((len(queries), k), np.inf, np.float32)
+        res_l = np.full((len(queries), k), -1, np.int64)
+        todo = np.arange(len(queries))
+        kk = k + min(len(self.tombstones), k)
+        while len(todo) > 0:
+            distances, labels = self.index.search(queries[todo], kk)
+            live = (labels >= 0) & ~np.isin(labels, self.tombstones)
+            done = (live.sum(axis=1) >= k) | (labels[:, -1] < 0) | (kk >= self.index.ntotal)
+            for j in np.flatnonzero(done):
+                found = labels[j][live[j]][:k]
+                res_d[todo[j], :len(found)] = distances[j][live[j]][:k]
+                res_l[todo[j], :len(found)] = [self.rows[key] for key in found.tolist()]
+            todo = todo[~done]
+            kk *= 2
+        return res_d, res_l
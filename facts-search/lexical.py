@@ -0,0 +1,238 @@
+import argparse
+import functools
+import hashlib
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import nltk
+from nltk import tokenize
+from nltk.stem.snowball import SnowballStemmer
+import numpy as np
+
+DATASET_PATH = 'dataset/dataset.jsonl'
+BM25_PATH = 'bm25'
+STEM_CACHE_SIZE = 1 << 16
+PUNCTUATION = {',', '.', ':', '-', ';', '?', '!', '"', "``", "`", "''"}
+
+
+def load_dataset(path_to_dataset):
+    res = []
+    with open(path_to_dataset, "r") as f:
+        data = f.readlines()
+        for d in data:
+            res.append(json.loads(d)['claim'])
+    return res
+
+
+def corpus_version(dataset):
+    h = hashlib.blake2b(digest_size=8)
+    for fact in dataset:
+        h.update(fact.encode('utf-8') + b'\n')
+    return h.hexdigest()
+
+
+def cached_stemmer(cache_size=STEM_CACHE_SIZE):
+    '''
+        Snowball stem function memoized in an LRU cache of cache_size words. The vocabulary is small
+        compared with the number of tokens, so nearly every word is stemmed once.
+    '''
+    return functools.lru_cache(maxsize=cache_size)(SnowballStemmer('english').stem)
+
+
+def fact_terms(fact, stem):
+    '''
+        Stemmed terms of a fact, the same tokenization as build_tdm. stem is a function (see cached_stemmer).
+    '''
+    res = []
+    for sentence in nltk.sent_tokenize(fact.lower()):
+        res += [stem(word) for word in tokenize.word_tokenize(sentence) if word not in PUNCTUATION]
+    return res
+
+
+def tokenize_shard(facts, cache_size=STEM_CACHE_SIZE):
+    '''
+        One pass over a part of the dataset: the terms of the shard in the order they first occur, the term ids
+        (into that list) of all the tokens and the number of tokens of every fact.
+    '''
+    stem = cached_stemmer(cache_size)
+    ids = {}
+    term_ids, lengths = [], np.zeros(len(facts), np.int32)
+    for ind, fact in enumerate(facts):
+        ts = fact_terms(fact, stem)
+        lengths[ind] = len(ts)
+        term_ids += [ids.setdefault(tm, len(ids)) for tm in ts]
+    return list(ids), np.array(term_ids, np.int64), lengths
+
+
+def tokenize_corpus(dataset, workers=1, shard_size=10000, cache_size=STEM_CACHE_SIZE):
+    '''
+        Tokenizes the dataset in shards of shard_size facts, in workers processes if workers > 1.
+        The vocabularies of the shards are merged as they come in: the term ids of a shard are mapped
+        to the ids of the whole corpus. Returns the term ids of all the tokens, the length of every fact
+        and the list of terms.
+    '''
+    shards = [dataset[i:i + shard_size] for i in range(0, len(dataset), shard_size)]
+    ids = {}
+    term_ids, lengths = [np.zeros(0, np.int64)], [np.zeros(0, np.int32)]
+
+    def merge(results):
+        for terms, shard_ids, shard_lengths in results:
+            mapping = np.array([ids.setdefault(tm, len(ids)) for tm in terms], np.int64)
+            term_ids.append(mapping[shard_ids])
+            lengths.append(shard_lengths)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            merge(pool.map(tokenize_shard, shards, itertools.repeat(cache_size)))
+    else:
+        merge(map(tokenize_shard, shards, itertools.repeat(cache_size)))
+    return np.concatenate(term_ids), np.concatenate(lengths), list(ids)
+
+
+def build_postings(dataset, workers=1):
+    '''
+        Inverted index of the dataset in CSR form, term-major: the postings of term t are
+        docs[indptr[t]:indptr[t + 1]] (sorted fact ids) with the term frequencies in tfs.
+        Only the (term, fact) pairs which occur are stored, instead of the dense terms x facts matrix.
+        Returns indptr, docs, tfs, the length of every fact in terms and the list of terms.
+    '''
+    term_ids, lengths, terms = tokenize_corpus(dataset, workers)
+    doc_ids = np.repeat(np.arange(len(dataset), dtype=np.int64), lengths)
+    indptr, docs, tfs = postings_from_pairs(term_ids, doc_ids, len(terms), len(dataset))
+    return indptr, docs, tfs, lengths, terms
+
+
+def postings_from_pairs(term_ids, doc_ids, n_terms, n_docs):
+    '''
+        CSR arrays (indptr, docs, tfs) from the term id of every token and the fact it is in.
+    '''
+    pairs, tfs = np.unique(term_ids * n_docs + doc_ids, return_counts=True)
+    terms, docs = np.divmod(pairs, n_docs)
+    indptr = np.zeros(n_terms + 1, np.int64)
+    np.cumsum(np.bincount(terms, minlength=n_terms), out=indptr[1:])
+    return indptr, docs.astype(np.int32), tfs.astype(np.int32)
+
+
+class BM25:
+    '''
+        BM25 ranking over a CSR inverted index. The BM25 weight of every posting,
+            idf(t) * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len / avglen)),
+        is computed once when the index is built, so a query only adds up the postings of its terms
+        into an array of scores (term at a time) and selects the top k with a partial sort.
+        save writes the arrays as .npy files, load memory-maps them: the index is not read into memory,
+        the pages of the postings a query touches are.
+    '''
+    ARRAYS = ('indptr', 'docs', 'weights')
+
+    def __init__(self, indptr, docs, weights, terms, n_docs, k1=1.2, b=0.75, version=None):
+        self.n = n_docs
+        self.version = version
+        self.indptr = indptr
+        self.docs = docs
+        self.weights = weights
+        self.terms = terms
+        self.vocabulary = {tm: i for i, tm in enumerate(terms)}
+        self.k1 = k1
+        self.b = b
+        self.stem = cached_stemmer()
+
+    @classmethod
+    def build(cls, indptr, docs, tfs, lengths, terms, k1=1.2, b=0.75):
+        n = len(lengths)
+        df = np.diff(indptr)
+        idf = np.log(1 + (n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = (k1 * (1 - b + b * lengths / max(lengths.mean(), 1))).astype(np.float32)
+        tfs = tfs.astype(np.float32)
+        weights = np.repeat(idf, df) * tfs * (k1 + 1) / (tfs + norm[docs])
+        return cls(indptr, docs, weights.astype(np.float32), terms, n, k1, b)
+
+    @classmethod
+    def from_dataset(cls, dataset, k1=1.2, b=0.75, workers=1):
+        res = cls.build(*build_postings(dataset, workers), k1=k1, b=b)
+        res.version = corpus_version(dataset)
+        return res
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'n_docs': self.n, 'k1': self.k1, 'b': self.b, 'version': self.version,
+                       'terms': self.terms}, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None) for name in cls.ARRAYS]
+        return cls(*arrays, meta['terms'], meta['n_docs'], meta['k1'], meta['b'], meta.get('version'))
+
+    def query_terms(self, query):
+        '''
+            Ids of the known terms of a query, a term repeated in the query counts as many times.
+        '''
+        return [self.vocabulary[tm] for tm in fact_terms(query, self.stem) if tm in self.vocabulary]
+
+    def scores(self, query):
+        '''
+            (facts, scores) of all the facts containing at least one term of the query.
+        '''
+        scores = np.zeros(self.n, np.float32)
+        for t in self.query_terms(query):
+            lo, hi = self.indptr[t], self.indptr[t + 1]
+            # the facts of one posting list are distinct, so the fancy-indexed add is safe
+            scores[self.docs[lo:hi]] += self.weights[lo:hi]
+        docs = np.flatnonzero(scores)
+        return docs, scores[docs]
+
+    def search(self, query, k=10):
+        '''
+            Top k facts of the query as (ids, scores), the best first.
+        '''
+        docs, scores = self.scores(query)
+        if len(docs) > k:
+            top = np.argpartition(-scores, k)[:k]
+            docs, scores = docs[top], scores[top]
+        order = np.argsort(-scores, kind='stable')
+        return docs[order], scores[order]
+
+
+def load_bm25(dataset, path=BM25_PATH, workers=1, rebuild=False):
+    '''
+        The BM25 index of dataset from path, built again if it is missing or was built for other facts.
+    '''
+    if not rebuild and os.path.exists(os.path.join(path, 'meta.json')):
+        bm25 = BM25.load(path)
+        if bm25.version == corpus_version(dataset):
+            return bm25
+    print('Building the BM25 index...')
+    start = time.perf_counter()
+    BM25.from_dataset(dataset, workers=workers).save(path)
+    print(f'Built in {time.perf_counter() - start:.1f} s')
+    return BM25.load(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='BM25 search over the facts')
+    parser.add_argument('queries', nargs='*',
+                        default=['Linus Torvalds', 'Harry Potter', 'CPU', 'Computer Science', 'Tom Cruise', 'Football'])
+    parser.add_argument('--dataset', default=DATASET_PATH)
+    parser.add_argument('--index', default=BM25_PATH,
+                        help='directory of the index, built if it does not exist or the dataset changed')
+    parser.add_argument('--rebuild', action='store_true')
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='processes tokenizing the dataset')
+    args = parser.parse_args()
+
+    dataset = load_dataset(args.dataset)
+    bm25 = load_bm25(dataset, args.index, args.workers, args.rebuild)
+
+    for query in args.queries:
+        start = time.perf_counter()
+        ids, scores = bm25.search(query, args.k)
+        elapsed = time.perf_counter() - start
+        print(f'Answers for the query: "{query}" ({elapsed * 1000:.2f} ms):')
+        for ind, score in zip(ids, scores):
+            print(f'\t{dataset[ind]} - id: {ind}, BM25: {score:.3f}')
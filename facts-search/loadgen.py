@@ -0,0 +1,78 @@
+import argparse
+import json
+import threading
+import time
+from urllib.parse import quote
+from urllib.request import urlopen
+import numpy as np
+
+QUERIES = ['Linus Torvalds', 'Harry Potter', 'CPU', 'Computer Science', 'Tom Cruise', 'Football']
+
+
+def worker(url, queries, k, deadline, latency, errors):
+    i = 0
+    while time.perf_counter() < deadline:
+        query = queries[i % len(queries)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            with urlopen(f'{url}/search?q={quote(query)}&k={k}') as response:
+                response.read()
+        except OSError:
+            errors.append(query)
+            continue
+        latency.append(time.perf_counter() - start)
+
+
+def run(url, queries, concurrency, seconds, k=10):
+    '''
+        concurrency clients sending queries one after another for the given number of seconds.
+    '''
+    latency, errors = [], []
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=worker, args=(url, queries[i:] + queries[:i], k, deadline, latency, errors))
+               for i in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    ms = np.array(latency) * 1000
+    return {
+        'concurrency': concurrency,
+        'requests': len(latency),
+        'errors': len(errors),
+        'qps': len(latency) / elapsed,
+        'p50_ms': float(np.percentile(ms, 50)) if len(ms) else None,
+        'p99_ms': float(np.percentile(ms, 99)) if len(ms) else None,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load generator for server.py: QPS and latency percentiles')
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--seconds', type=float, default=10.0, help='duration of every run')
+    parser.add_argument('--queries', default=None, help='file with a query per line')
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--output', default=None, help='json file for the results')
+    args = parser.parse_args()
+
+    queries = QUERIES
+    if args.queries is not None:
+        with open(args.queries) as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    results = []
+    for c in args.concurrency:
+        r = run(args.url, queries, c, args.seconds, args.k)
+        results.append(r)
+        print(f'concurrency {c:4}: {r["qps"]:8.1f} qps  p50 {r["p50_ms"]:7.2f} ms  p99 {r["p99_ms"]:7.2f} ms  '
+              f'{r["requests"]} requests, {r["errors"]} errors')
+        with urlopen(f'{args.url}/stats') as response:
+            print(f'\tserver: {json.loads(response.read())}')
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -1,59 +1,33 @@
-import json
-import nltk
-from nltk import tokenize
-from nltk.stem.snowball import SnowballStemmer
+import os
 import sys
 from sentence_transformers import SentenceTransformer
 import numpy as np
-import faiss
+from scipy import sparse
+from lexical import load_dataset, tokenize_corpus, postings_from_pairs
+from store import MODEL_NAME, EmbeddingStore, fact_keys
+from indexing import IncrementalIndex, set_search_params
 
 DATASET_PATH = 'dataset/dataset.jsonl'
-INDEX_PATH = 'index.ext'
 
 
-def load_dataset(path_to_dataset):
-    res = []
-    with open(path_to_dataset, "r") as f:
-        data = f.readlines()
-        for d in data:
-            res.append(json.loads(d)['claim'])
-    return res
-
-
-def build_tdm(dataset):
+def build_tdm(dataset, workers=1):
     '''
-        Could not build TDM for the given dataset. Number of facts: 145449, number of unique terms: 17989.
-        The process crashed because of memory limitations (exit code 137)
+        Term-document matrix of the dataset as a scipy.sparse CSR matrix (terms x facts).
+        The dense version, lists of len(dataset) counts for every term, could not be built: for 145449 facts
+        and 17989 unique terms the process crashed because of memory limitations (exit code 137).
+        The dataset is tokenized in one pass, in shards over workers processes, with the stems cached.
     '''
-
-    stemmer = SnowballStemmer('english')
-    words_set = {}
-    terms = []
-    index = 0
-    for ind, fact in enumerate(dataset):
-        for sentence in nltk.sent_tokenize(fact.lower()):
-            ts = [stemmer.stem(word) for word in tokenize.word_tokenize(sentence) if
-                  word not in (',', '.', ':', '-', ';', '?', '!', '"', "``", "`", "''")]
-            for tm in ts:
-                if tm not in words_set:
-                    words_set[tm] = index
-                    index += 1
-                    terms.append(tm)
-
+    term_ids, lengths, terms = tokenize_corpus(dataset, workers)
     print(f'Dictionary is built. Total of {len(terms)} terms in the dictionary')
-    tdm = [[0] * len(dataset) for _ in range(len(terms))]
-    for ind, fact in enumerate(dataset):
-        for sentence in nltk.sent_tokenize(fact.lower()):
-            ts = [stemmer.stem(word) for word in tokenize.word_tokenize(sentence) if
-                  word not in (',', '.', ':', '-', ';', '?', '!', '"', "``", "`", "''")]
-            for tm in ts:
-                tdm[words_set[tm]][ind] += 1
+    doc_ids = np.repeat(np.arange(len(dataset)), lengths)
+    indptr, docs, tfs = postings_from_pairs(term_ids, doc_ids, len(terms), len(dataset))
+    tdm = sparse.csr_matrix((tfs, docs, indptr), shape=(len(terms), len(dataset)))
     return tdm, terms
 
 
 class Transformer:
     def __init__(self):
-        self.model = SentenceTransformer('bert-base-nli-mean-tokens')
+        self.model = SentenceTransformer(MODEL_NAME)
 
     def embed_all(self, sentences: list):
         return self.model.encode(sentences, show_progress_bar=True, num_workers=4)
@@ -61,12 +35,30 @@ class Transformer:
     def embed(self, sentence: str):
         return self.model.encode([sentence])[0]
 
+    def embed_batch(self, sentences: list):
+        return self.model.encode(sentences, batch_size=len(sentences))
+
 
-def build_index(data, dimensions=768):
-    index = faiss.index_factory(dimensions, "L2norm,IVF2048_HNSW32,Flat")
-    index.train(data)
-    index.add(data)
-    faiss.write_index(index, INDEX_PATH)
+def load_embeddings(dataset, model):
+    store = EmbeddingStore(model=MODEL_NAME)
+    cache = None
+    if store.count == 0 and os.path.exists('embeddings.txt'):
+        # embeddings.txt of an earlier run (or the download from the README) has the vectors of the whole dataset
+        print('Found embeddings.txt file. Reading...')
+        vectors = np.load('embeddings.txt', mmap_mode='r')
+        if len(vectors) == len(dataset):
+            cache = (fact_keys(dataset), vectors)
+    print('Embedding...')
+    return store.update(dataset, model.embed_all, cache).vectors
+
+
+def load_index(dataset, embeddings, nprobe=None, ef_search=None):
+    '''
+        The index of the facts, updated with the facts added to or removed from the dataset since the last run.
+        Results are rows of the dataset.
+    '''
+    index = IncrementalIndex(MODEL_NAME, embeddings.shape[1]).sync(dataset, embeddings)
+    set_search_params(index.index, nprobe, ef_search)
     return index
 
 
@@ -82,28 +74,8 @@ if __name__ == '__main__':
     # Method 2. Using sentence BERT model
 
     model = Transformer()
-    save = False
-    try:
-        print('Found embeddings.txt file. Reading...')
-        f = open('embeddings.txt', 'rb')
-        embeddings = np.load(f)
-    except IOError as err:
-        save = True
-        print('Embedding...')
-        embeddings = model.embed_all(dataset)
-
-    if save:
-        with open('embeddings.txt', "wb") as f:
-            np.save(f, embeddings)
-
-    index = None
-    try:
-        print('Trying to load index from disk')
-        index = faiss.read_index(INDEX_PATH)
-    except:
-        print('Index loading failed. Building new index...')
-        index = build_index(embeddings)
-        print('Building is finished!')
+    embeddings = load_embeddings(dataset, model)
+    index = load_index(dataset, embeddings)
 
     queries = ['Linus Torvalds', 'Harry Potter', 'CPU', 'Computer Science', 'Tom Cruise', 'Football']
     query_embeddings = model.embed_all(queries)
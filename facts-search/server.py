@@ -0,0 +1,214 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+from main import DATASET_PATH, Transformer, load_dataset, load_embeddings, load_index
+from lexical import load_bm25
+from hybrid import HybridRetriever
+
+HOST, PORT = '127.0.0.1', 8000
+# largest k a request can ask for, the results of a batch are k wide
+MAX_K = 1000
+
+
+class DenseSearcher:
+    '''
+        The model and the index of main.py, loaded once. search embeds a batch of queries with one
+        model.encode call and searches them with one index.search call.
+        The scores are cosine similarities, higher is better, like the ones of HybridRetriever.
+    '''
+
+    def __init__(self, model, index):
+        self.model = model
+        self.index = index
+
+    def search(self, queries, k):
+        vectors = np.ascontiguousarray(self.model.embed_batch(queries), dtype=np.float32)
+        distances, ids = self.index.search(vectors, k)
+        # squared L2 distance of the normalized vectors: 2 - 2 cos
+        return 1 - distances / 2, ids
+
+
+class Batcher:
+    '''
+        Collects the queries of concurrent requests into batches: a batch is searched when it has max_batch
+        queries or max_wait seconds after its first query arrived, whichever comes first.
+        The queries of a batch are grouped by k and every group is searched on its own, so a query is never
+        searched deeper than it asked for and a failing group doesn't fail the others.
+        submit returns a Future of the (ids, scores) of one query.
+    '''
+
+    def __init__(self, search, max_batch=32, max_wait=0.005):
+        self.search = search
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.queries = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def submit(self, query, k=10):
+        future = Future()
+        self.requests.put((query, k, future))
+        return future
+
+    def collect(self):
+        batch = [self.requests.get()]
+        if batch[0] is None:
+            return None
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                self.requests.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.collect()
+            if batch is None:
+                return
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[1], []).append(item)
+            for k, group in groups.items():
+                try:
+                    scores, ids = self.search([item[0] for item in group], k)
+                except Exception as e:
+                    for _, _, future in group:
+                        future.set_exception(e)
+                    continue
+                for i, (_, _, future) in enumerate(group):
+                    future.set_result((ids[i], scores[i]))
+            self.batches += 1
+            self.queries += len(batch)
+
+    def stop(self):
+        self.requests.put(None)
+        self.thread.join()
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 makes bursts of connections wait for a SYN retry, a second later
+    request_queue_size = 128
+
+
+def make_handler(batcher, dataset, timeout=10.0):
+    class Handler(BaseHTTPRequestHandler):
+        '''
+            GET /search?q=...&k=10 or POST /search with {"query": ..., "k": 10},
+            GET /stats for the number of queries and batches.
+        '''
+
+        def send_json(self, code, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def answer(self, query, k):
+            if not query or not isinstance(query, str):
+                return self.send_json(400, {'error': 'empty query'})
+            try:
+                k = int(k)
+            except (TypeError, ValueError):
+                k = None
+            if k is None or not 1 <= k <= MAX_K:
+                return self.send_json(400, {'error': f'k has to be an integer from 1 to {MAX_K}'})
+            start = time.perf_counter()
+            try:
+                ids, scores = batcher.submit(query, k).result(timeout)
+            except Exception as e:
+                return self.send_json(500, {'error': f'{type(e).__name__}: {e}'})
+            results = [{'id': int(i), 'fact': dataset[i], 'score': float(s)} for i, s in zip(ids, scores) if i >= 0]
+            self.send_json(200, {'query': query, 'results': results,
+                                 'latency_ms': (time.perf_counter() - start) * 1000})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/stats':
+                return self.send_json(200, {'queries': batcher.queries, 'batches': batcher.batches,
+                                            'mean_batch': batcher.queries / max(1, batcher.batches)})
+            if url.path != '/search':
+                return self.send_json(404, {'error': 'not found'})
+            params = parse_qs(url.query)
+            self.answer(params.get('q', [''])[0], params.get('k', ['10'])[0])
+
+        def do_POST(self):
+            if urlparse(self.path).path != '/search':
+                return self.send_json(404, {'error': 'not found'})
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            except ValueError:
+                return self.send_json(400, {'error': 'invalid json'})
+            if not isinstance(body, dict):
+                return self.send_json(400, {'error': 'expected a json object'})
+            self.answer(body.get('query', ''), body.get('k', 10))
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(searcher, dataset, host=HOST, port=PORT, max_batch=32, max_wait=0.005):
+    batcher = Batcher(searcher.search, max_batch, max_wait).start()
+    server = Server((host, port), make_handler(batcher, dataset))
+    print(f'Serving on http://{host}:{server.server_port}/search?q=...')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Keeps the model and the index loaded and answers queries over HTTP')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--max-batch', type=int, default=32, help='most queries encoded and searched together')
+    parser.add_argument('--max-wait', type=float, default=0.005,
+                        help='seconds a query waits for others to join its batch')
+    parser.add_argument('--nprobe', type=int, default=None, help='IVF cells visited per query')
+    parser.add_argument('--ef-search', type=int, default=None, help='HNSW candidate list size')
+    parser.add_argument('--hybrid', choices=['rrf', 'weighted'], default=None,
+                        help='fuse the dense results with BM25 ones, the scores are then the fused ones')
+    parser.add_argument('--rerank', action='store_true',
+                        help='blend the hybrid scores with the exact cosine similarity of the candidates')
+    parser.add_argument('--rerank-weight', type=float, default=0.5, help='share of the cosine similarity in --rerank')
+    args = parser.parse_args()
+
+    dataset = load_dataset(DATASET_PATH)
+    model = Transformer()
+    embeddings = load_embeddings(dataset, model)
+    index = load_index(dataset, embeddings, args.nprobe, args.ef_search)
+    if args.hybrid:
+        searcher = HybridRetriever(model, load_bm25(dataset), index, embeddings, args.hybrid, rerank=args.rerank,
+                                   rerank_weight=args.rerank_weight)
+    else:
+        searcher = DenseSearcher(model, index)
+    # the first encode call is much slower than the rest
+    searcher.search(['warm up'], 1)
+    serve(searcher, dataset, args.host, args.port, args.max_batch, args.max_wait)
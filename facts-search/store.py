@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+
+STORE_PATH = 'embeddings'
+# the sentence-transformers model of main.py, the stored embeddings are tagged with it
+MODEL_NAME = 'bert-base-nli-mean-tokens'
+SHARD_SIZE = 4096
+
+
+def fact_key(fact):
+    '''
+        64-bit content hash of a fact, the key its embedding is cached by.
+    '''
+    return int.from_bytes(hashlib.blake2b(fact.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def fact_keys(dataset):
+    return np.array([fact_key(fact) for fact in dataset], np.uint64)
+
+
+def common_prefix(a, b):
+    '''
+        Length of the common beginning of two key arrays.
+    '''
+    n = min(len(a), len(b))
+    diff = np.flatnonzero(a[:n] != b[:n])
+    return n if len(diff) == 0 else int(diff[0])
+
+
+class EmbeddingStore:
+    '''
+        Embeddings of the facts on disk, in the order of the dataset:
+            vectors.bin   - count x dim vectors, float32 or float16, raw
+            keys.bin      - the fact_key of every row, uint64
+            manifest.json - model, dim, dtype and count, the number of rows known to be complete
+        update embeds the facts in shards of shard_size and appends every shard to the files, the manifest
+        is rewritten after the data is flushed. If the process dies, the next update continues after the last
+        finished shard, also when the store was being rewritten in the .rebuild directory.
+        Facts whose key is already in the store are not embedded again.
+        vectors is a read-only np.memmap of all the rows, nothing is loaded into memory.
+    '''
+
+    def __init__(self, path=STORE_PATH, dim=768, dtype='float32', model=None, shard_size=SHARD_SIZE):
+        self.path = path
+        self.shard_size = shard_size
+        self.meta = {'model': model, 'dim': dim, 'dtype': np.dtype(dtype).name, 'count': 0}
+        rebuild, old = self._sibling('.rebuild'), self._sibling('.old')
+        if not os.path.exists(path) and os.path.exists(old) and os.path.exists(rebuild):
+            # update died between the two renames of the swap, the rebuilt store is complete
+            os.replace(rebuild, path)
+        if os.path.exists(old) and os.path.exists(path):
+            shutil.rmtree(old)
+        os.makedirs(path, exist_ok=True)
+        meta = self._load_meta(path)
+        if meta is not None:
+            if self._compatible(meta):
+                self.meta = meta
+            else:
+                print(f'Embeddings in {path} are of another model or format, they will be recomputed')
+
+    @property
+    def count(self):
+        return self.meta['count']
+
+    @property
+    def dim(self):
+        return self.meta['dim']
+
+    @property
+    def dtype(self):
+        return np.dtype(self.meta['dtype'])
+
+    def _file(self, name, path=None):
+        return os.path.join(path or self.path, name)
+
+    def _sibling(self, suffix):
+        return self.path.rstrip('/\\') + suffix
+
+    def _load_meta(self, path):
+        manifest = self._file('manifest.json', path)
+        if not os.path.exists(manifest):
+            return None
+        with open(manifest) as f:
+            return json.load(f)
+
+    def _compatible(self, meta):
+        return all(meta[name] == self.meta[name] for name in ('model', 'dim', 'dtype'))
+
+    def _resume_count(self, path, keys):
+        '''
+            Number of rows of the unfinished store in path which are already the embeddings of keys[:rows].
+        '''
+        meta = self._load_meta(path)
+        if meta is None or not self._compatible(meta) or meta['count'] == 0:
+            return 0
+        count = min(meta['count'], len(keys))
+        if os.path.getsize(self._file('keys.bin', path)) < count * 8:
+            return 0
+        return common_prefix(np.memmap(self._file('keys.bin', path), np.uint64, 'r', shape=(count,)), keys)
+
+    def _truncate(self, path, count):
+        for name, size in (('vectors.bin', count * self.dim * self.dtype.itemsize), ('keys.bin', count * 8)):
+            with open(self._file(name, path), 'ab') as f:
+                f.truncate(size)
+
+    def _save_meta(self, path, count):
+        meta = dict(self.meta, count=count)
+        tmp = self._file('manifest.json.tmp', path)
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._file('manifest.json', path))
+        if path == self.path:
+            self.meta = meta
+
+    @property
+    def vectors(self):
+        if self.count == 0:
+            return np.zeros((0, self.dim), self.dtype)
+        return np.memmap(self._file('vectors.bin'), self.dtype, 'r', shape=(self.count, self.dim))
+
+    @property
+    def keys(self):
+        if self.count == 0:
+            return np.zeros(0, np.uint64)
+        return np.memmap(self._file('keys.bin'), np.uint64, 'r', shape=(self.count,))
+
+    def update(self, dataset, embed, cache=None):
+        '''
+            Makes the store hold the embeddings of dataset, embed(facts) computing the missing ones.
+            If the stored facts are the beginning of dataset (an unfinished run, or facts added at the end),
+            the rest is appended. Otherwise the store is rewritten in a new directory, reusing the vectors of
+            the facts it already has, and the directories are swapped when it is finished: the store is always
+            either the old one or the new one, never a mix of their files.
+            cache is an optional (keys, vectors) pair to take embeddings from, e.g. an old embeddings file.
+        '''
+        keys = fact_keys(dataset)
+        old_keys, old_vectors = self.keys, self.vectors
+        prefix = common_prefix(old_keys, keys)
+
+        lookup = {}
+        for source in ([cache] if cache is not None else []) + [(old_keys, old_vectors)]:
+            lookup.update((key, (source[1], row)) for row, key in enumerate(source[0].tolist()))
+
+        if prefix == self.count or prefix == len(keys):
+            # rows written after the last manifest update belong to an unfinished shard,
+            # the ones after prefix to facts removed from the end
+            self._truncate(self.path, prefix)
+            self._save_meta(self.path, prefix)
+            self._fill(self.path, dataset, keys, prefix, lookup, embed)
+        else:
+            path, old = self._sibling('.rebuild'), self._sibling('.old')
+            os.makedirs(path, exist_ok=True)
+            start = self._resume_count(path, keys)
+            self._truncate(path, start)
+            self._save_meta(path, start)
+            self._fill(path, dataset, keys, start, lookup, embed)
+            del old_keys, old_vectors, lookup
+            os.replace(self.path, old)
+            os.replace(path, self.path)
+            shutil.rmtree(old)
+            self.meta = self._load_meta(self.path)
+        return self
+
+    def _fill(self, path, dataset, keys, start, lookup, embed):
+        embedded = 0
+        with open(self._file('vectors.bin', path), 'ab') as vf, open(self._file('keys.bin', path), 'ab') as kf:
+            for lo in range(start, len(dataset), self.shard_size):
+                hi = min(lo + self.shard_size, len(dataset))
+                shard = np.empty((hi - lo, self.dim), self.dtype)
+                missing = []
+                for i, key in enumerate(keys[lo:hi].tolist()):
+                    if key in lookup:
+                        vectors, row = lookup[key]
+                        shard[i] = vectors[row]
+                    else:
+                        missing.append(i)
+                if missing:
+                    shard[missing] = embed([dataset[lo + i] for i in missing])
+                    embedded += len(missing)
+                vf.write(shard.tobytes())
+                kf.write(keys[lo:hi].tobytes())
+                for f in (vf, kf):
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._save_meta(path, hi)
+                print(f'Embeddings: {hi}/{len(dataset)} facts, {embedded} embedded')